@@ -1,37 +1,70 @@
-from server import Server
+import numpy as np
+from server import Server, ServerPool
 from vm import VM
 from config import LIMIT_RATIO
+from allocator_kernels import HAVE_NUMBA, fits_nowhere, greedy_displace_kernel
 
-def try_allocate_to_existing(servers, vm):
-    for server in servers:
-        if server.allocate_vm(vm, LIMIT_RATIO):
-            return True
-    return False
+def try_allocate_to_existing(servers: ServerPool, vm):
+    """Allocate a VM to the best fitting existing server; return that server, or None."""
+    server = servers.best_fit(vm, LIMIT_RATIO)
+    if server is not None:
+        server._unchecked_allocate(vm)
+    return server
 
-def greedy_allocate(servers: list[Server], new_vm: VM):
+def greedy_allocate(servers: ServerPool, new_vm: VM):
     if try_allocate_to_existing(servers, new_vm):
         return servers
-    
-    vm_mappings = []
-    for server in servers:
-        for vm in server.allocated:
-            vm_mappings.append((server, vm))
-    
-    for server, vm in vm_mappings:
+
+    move = find_displacement(servers, new_vm)
+    if move is not None:
+        # both placements are known to fit, so skip re-checking them
+        server, vm, target = move
         server.remove_vm(vm)
-        
-        if try_allocate_to_existing(servers, new_vm):
-            if try_allocate_to_existing(servers, vm):
-                return servers
-            
-            for s in servers:
-                if new_vm in s.allocated:
-                    s.remove_vm(new_vm)
-                    break
-            
-        server.allocate_vm(vm)
-    
+        server._unchecked_allocate(new_vm)
+        target._unchecked_allocate(vm)
+        return servers
+
     new_server = Server(servers[0].capacity)
     new_server.allocate_vm(new_vm, LIMIT_RATIO)
     servers.append(new_server)
-    return servers
\ No newline at end of file
+    return servers
+
+def find_displacement(servers: ServerPool, new_vm: VM):
+    """
+    Find a (server, vm, target) move that makes room for new_vm on server
+    by moving vm to target, or None.
+
+    new_vm fits nowhere as-is, so displacing a VM can only make room on the
+    server it leaves, and only if it is at least as big as that server's
+    shortfall. The smallest such VM is the easiest one to re-home: if it
+    fits nowhere else, no bigger one will either.
+    """
+    if fits_nowhere(servers.limits, new_vm.size()):
+        return None  # no move could make room for it
+
+    if HAVE_NUMBA:
+        # flatten every server's VM sizes for the compiled kernel
+        counts = np.fromiter((len(s.allocated) for s in servers), dtype=np.int64, count=len(servers))
+        offsets = np.zeros(len(servers) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        vm_sizes = np.fromiter((vm.size() for s in servers for vm in s.allocated),
+                               dtype=np.float64, count=offsets[-1])
+        i, j, t = greedy_displace_kernel(servers.capacities, servers.limits, servers.used,
+                                         vm_sizes, offsets, new_vm.size())
+        if i < 0:
+            return None
+        return servers[i], servers[i].allocated[j], servers[t]
+
+    # Interpreted, the kernel's element-wise loops would be slower than this
+    # one, which leans on the pool's free-space index
+    for server in servers:
+        shortfall = new_vm.size() - (server._limit - server.used_memory())
+        vm = min((vm for vm in server.allocated if vm.size() >= shortfall),
+                 key=VM.size, default=None)
+        if vm is None:
+            continue
+
+        target = servers.best_fit(vm, LIMIT_RATIO, exclude=server)
+        if target is not None:
+            return server, vm, target
+    return None
@@ -0,0 +1,68 @@
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    # without Numba the kernels still run, just interpreted
+    HAVE_NUMBA = False
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+def fits_nowhere(limits, size):
+    """
+    Whether a VM of the given size is over every server's limit, or there
+    are no servers. Callers check this before any array arithmetic, as an
+    int too big for the pool's float64 arrays would raise OverflowError
+    rather than not fit.
+    """
+    # a plain float, as Python compares any int with it exactly where
+    # np.float64 would try to convert the int
+    return not limits.size or size > float(limits.max())
+
+
+@njit(cache=True)
+def greedy_displace_kernel(capacities, limits, used, vm_sizes, offsets, size):
+    """
+    Find a VM to move so that a VM of the given size fits where it was.
+    Server i holds vm_sizes[offsets[i]:offsets[i + 1]]. Returns
+    (server, vm, target): the index of the server to make room on, the
+    VM's index within that server, and the server to move it to, or
+    (-1, -1, -1) if no single move makes room.
+    """
+    n = len(used)
+    for i in range(n):
+        shortfall = size - (limits[i] - used[i])
+
+        # the smallest VM that would free enough room is the easiest to re-home
+        vm = -1
+        for j in range(offsets[i], offsets[i + 1]):
+            if vm_sizes[j] >= shortfall and (vm < 0 or vm_sizes[j] < vm_sizes[vm]):
+                vm = j
+        if vm < 0:
+            continue
+
+        # best fit for it among the other servers
+        target = -1
+        for t in range(n):
+            if t != i and used[t] + vm_sizes[vm] <= limits[t] and (
+                    target < 0 or capacities[t] - used[t] < capacities[target] - used[target]):
+                target = t
+        if target >= 0:
+            return i, vm - offsets[i], target
+    return -1, -1, -1
+
+
+@njit(cache=True)
+def first_fit_kernel(limits, used, size, start):
+    """
+    Index of the first server with room for a VM of the given size,
+    checking from start onwards and wrapping around, or -1 if none has.
+    """
+    n = len(used)
+    for k in range(n):
+        i = (start + k) % n
+        if used[i] + size <= limits[i]:
+            return i
+    return -1
@@ -1,14 +1,115 @@
 # distributed_allocator.py
+import asyncio
+import heapq
+import itertools
 import socket
 import json
+import struct
 import threading
 import time
-from server import Server
-from vm import VM
+from server import Server, ServerPool
+from vm import get_vm
 from config import DEFAULT_SERVER_CAPACITY, LIMIT_RATIO
-from new_allocator import best_fit_allocate, weight_balanced_allocate
+from new_allocator import (
+    first_fit_allocate_vec,
+    best_fit_allocate_vec,
+    weight_balanced_allocate_vec
+)
+
+try:
+    import orjson
+    _dumps = orjson.dumps  # returns bytes, no separate encode step
+    _loads = orjson.loads
+except ImportError:
+    # stdlib json speaks the same wire format, just slower
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    _loads = json.loads
+
+# Every message is a 4-byte big-endian length followed by a JSON payload, so
+# replies of any size arrive whole instead of being cut off at one recv()
+_FRAME_HEADER = struct.Struct('>I')
+
+# The length comes from the peer, so cap it rather than allocate whatever
+# a bad header asks for; real messages are far smaller than this
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+def _frame_size(header):
+    (size,) = _FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return size
+
+def _frame(payload):
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+def connect_socket(host, port, timeout=5.0):
+    """
+    Open a TCP connection for RPC. Nagle's algorithm is turned off, as every
+    message is one small frame that should go out at once rather than wait
+    for the previous one's ACK.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.settimeout(timeout)  # Set timeout for socket operations
+        s.connect((host, port))
+    except OSError:
+        s.close()
+        raise
+    return s
+
+def send_frame(sock, payload):
+    """Send an already-encoded payload as one length-prefixed frame"""
+    sock.sendall(_frame(payload))
+
+def send_msg(sock, message):
+    """Encode a message as JSON and send it as one frame"""
+    send_frame(sock, _dumps(message))
+
+def _recv_exactly(sock, size):
+    """Read exactly size bytes into a new buffer; empty if the peer closed first"""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            if len(view) == size:
+                return bytearray()
+            raise ConnectionError("Connection closed in the middle of a message")
+        view = view[received:]
+    return buf
+
+def recv_frame(sock):
+    """Receive one frame's payload; empty if the peer closed the connection"""
+    header = _recv_exactly(sock, _FRAME_HEADER.size)
+    if not header:
+        return header
+    return _recv_exactly(sock, _frame_size(header))
+
+async def read_frame(reader):
+    """asyncio counterpart of recv_frame, reading from a StreamReader"""
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("Connection closed in the middle of a message")
+        return b''
+    return await reader.readexactly(_frame_size(header))
+
+def write_frame(writer, payload):
+    """asyncio counterpart of send_frame; the caller drains the writer"""
+    writer.write(_frame(payload))
+
+def write_msg(writer, message):
+    """asyncio counterpart of send_msg; the caller drains the writer"""
+    write_frame(writer, _dumps(message))
+
 
 class NetworkServer(Server):
+    __slots__ = ('ip_address', 'port', 'last_heartbeat', 'is_active', 'generation',
+                 '_status_prefix', '_vm_prefix')
+    
     def __init__(self, capacity, ip_address, port=5000):
         # if None is encountered
         if capacity is None:
@@ -16,38 +117,54 @@ class NetworkServer(Server):
         super().__init__(capacity)
         self.ip_address = ip_address
         self.port = port
-        self.last_heartbeat = time.time()
+        self.last_heartbeat = time.monotonic_ns()  # integer nanoseconds, immune to clock changes
         self.is_active = True
+        # Bumped whenever a report from the server replaces our model of its
+        # VMs, so a reservation made before then can be told apart from a
+        # reported VM of the same (shared) size
+        self.generation = 0
+        
+        # The fixed fields of this server's entries in status and VM sync
+        # replies, encoded once with the closing brace left off
+        self._status_prefix = _dumps({'ip': ip_address, 'capacity': capacity})[:-1]
+        self._vm_prefix = _dumps({'server_ip': ip_address})[:-1]
+    
+    def replace_vms(self, vms):
+        self.generation += 1
+        super().replace_vms(vms)
+    
+    def apply_report(self, memories):
+        # Even a report that leaves the list as it was supersedes any
+        # reservation in it
+        self.generation += 1
+        super().apply_report(memories)
     
     def __repr__(self):
         return f"NetworkServer(IP: {self.ip_address}, Capacity: {self.capacity}, Used: {self.used_memory()}, Free: {self.free_space()})"
 
     # Directly allocate on the actual server
     def remote_allocate_vm(self, vm):
-        """Allocate a VM on the remote server"""
+        """
+        Allocate a VM on the remote server. Only the remote side is changed;
+        the caller has already reserved the VM in its local model.
+        """
         try:
             message = {
                 'type': 'allocate_vm',
                 'memory': vm.memory
             }
             
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5.0)
-                s.connect((self.ip_address, self.port))
-                s.send(json.dumps(message).encode('utf-8'))
+            with connect_socket(self.ip_address, self.port) as s:
+                send_msg(s, message)
                 
-                data = s.recv(4096).decode('utf-8')
+                data = recv_frame(s)
                 if not data:
                     print(f"Empty response from remote server {self.ip_address}")
                     return False
                     
                 try:
-                    response = json.loads(data)
-                    success = response.get('status') == 'allocated'
-                    if success:
-                        # Update our local model of the server
-                        self.allocated.append(vm)
-                    return success
+                    response = _loads(data)
+                    return response.get('status') == 'allocated'
                 except json.JSONDecodeError:
                     return False
         except Exception as e:
@@ -59,92 +176,130 @@ class CoordinatorService:
     def __init__(self, host='0.0.0.0', port=5000):
         self.host = host
         self.port = port
-        self.servers = {}  # Dictionary of ip_address: NetworkServer
-        self.server_lock = threading.Lock()
+        # ip_address: NetworkServer. Only the event loop's thread touches the
+        # registry and pool, and never across an await, so they need no lock
+        self.servers = {}
+        # Every registered server in registration order, with the fleet's
+        # capacity/usage arrays used to score allocations
+        self.pool = ServerPool()
         self.running = False
         self.heartbeat_timeout = 10  # seconds
+        self._heartbeat_timeout_ns = self.heartbeat_timeout * 1_000_000_000
+        # (deadline, seq, server) for every heartbeat received; an entry is
+        # stale once its server has sent a newer heartbeat or been replaced
+        self._deadlines = []
+        self._deadline_seq = itertools.count()
+        self.connections = {}  # handler task: StreamWriter, for open connections
 
     def start(self):
         """Start the coordinator service"""
         self.running = True
         
-        # Start server socket
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        
-        # Start threads for services
-        threading.Thread(target=self._accept_connections, daemon=True).start()
-        threading.Thread(target=self._monitor_servers, daemon=True).start()
+        # One event loop multiplexes every connection instead of a thread per
+        # connection; it runs in its own thread so start() still returns
+        self.loop = asyncio.new_event_loop()
+        self.listener = self.loop.run_until_complete(
+            asyncio.start_server(self._handle_connection, self.host, self.port,
+                                 reuse_address=True))
+        self.monitor_task = self.loop.create_task(self._monitor_servers())
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
         
         print(f"Coordinator started on {self.host}:{self.port}")
     
     def stop(self):
         """Stop the coordinator service"""
         self.running = False
-        self.server_socket.close()
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
     
-    def _accept_connections(self):
-        """Accept incoming connections from servers and clients"""
-        while self.running:
-            try:
-                client_socket, addr = self.server_socket.accept()
-                threading.Thread(target=self._handle_connection, 
-                                args=(client_socket, addr), daemon=True).start()
-            except Exception as e:
-                if self.running:
-                    print(f"Error accepting connection: {e}")
+    async def _shutdown(self):
+        """Close the listening socket and open connections, and stop the monitor"""
+        self.listener.close()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.monitor_task.cancel()
+        await asyncio.gather(self.monitor_task, return_exceptions=True)
     
-    def _handle_connection(self, client_socket, addr):
-        """Handle an incoming connection"""
+    async def _handle_connection(self, reader, writer):
+        """Handle an incoming connection, answering messages until the peer closes it"""
+        addr = writer.get_extra_info('peername')
+        self.connections[asyncio.current_task()] = writer
         try:
-            # Itimeout for reliability, std practice
-            client_socket.settimeout(5.0)
-            data = client_socket.recv(4096).decode('utf-8')
-            
-            if not data:
-                print(f"Empty data received from {addr}")
-                return
+            while True:
+                # Agents keep their connection open between heartbeats, so an
+                # idle connection is only dropped once its server would time out
+                data = await asyncio.wait_for(read_frame(reader), self.heartbeat_timeout)
+                if not data:
+                    break
                 
-            try:
-                message = json.loads(data)
-            except json.JSONDecodeError as e:
-                print(f"Invalid JSON from {addr}: {data[:100]}... Error: {e}")
-                client_socket.send(json.dumps({'status': 'error', 'message': 'Invalid JSON'}).encode('utf-8'))
-                return
-            
-            if message['type'] == 'register':
-                self._register_server(message, addr)
-                response = {'status': 'registered'}
-            
-            elif message['type'] == 'heartbeat':
-                self._update_heartbeat(message)
-                response = {'status': 'ok'}
-            
-            elif message['type'] == 'allocate_vm':
-                success = self._allocate_vm(message)
-                response = {'status': 'allocated' if success else 'failed'}
-            
-            elif message['type'] == 'server_status':
-                response = self._get_server_status()
-            
-            elif message['type'] == 'sync_vms':
-                response = self._get_all_vms()
-            
-            else:
-                response = {'status': 'unknown_command'}
-            
-            # sending out response
-            client_socket.send(json.dumps(response).encode('utf-8'))
+                try:
+                    message = _loads(data)
+                    response = await self._handle_message(message, addr)
+                except json.JSONDecodeError as e:
+                    print(f"Invalid JSON from {addr}: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
+                    response = {'status': 'error', 'message': 'Invalid JSON'}
+                except Exception as e:
+                    print(f"Error handling message from {addr}: {e}")
+                    response = {'status': 'error', 'message': str(e)}
+                
+                # sending out response, which may come already encoded
+                if isinstance(response, bytes):
+                    write_frame(writer, response)
+                else:
+                    write_msg(writer, response)
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass  # idle connection, or the peer went away mid-message
         except Exception as e:
             print(f"Error handling connection from {addr}: {e}")
-            try:
-                client_socket.send(json.dumps({'status': 'error', 'message': str(e)}).encode('utf-8'))
-            except:
-                pass
         finally:
-            client_socket.close()
+            del self.connections[asyncio.current_task()]
+            writer.close()
+    
+    async def _handle_message(self, message, addr):
+        """Act on one message and return the response to send back"""
+        if message['type'] == 'register':
+            self._register_server(message, addr)
+            return {'status': 'registered'}
+        
+        elif message['type'] == 'heartbeat':
+            self._update_heartbeat(message)
+            return {'status': 'ok'}
+        
+        elif message['type'] == 'allocate_vm':
+            success = await self._allocate_vm(message)
+            return {'status': 'allocated' if success else 'failed'}
+        
+        elif message['type'] == 'allocate_vm_batch':
+            results = await self._allocate_vm_batch(message)
+            return {'results': ['allocated' if success else 'failed' for success in results]}
+        
+        elif message['type'] == 'allocate_vm_batch_ffd':
+            results = await self._allocate_vm_batch(message, decreasing=True)
+            return {'results': ['allocated' if success else 'failed' for success in results]}
+        
+        elif message['type'] == 'server_status':
+            return self._get_server_status()
+        
+        elif message['type'] == 'sync_vms':
+            return self._get_all_vms()
+        
+        return {'status': 'unknown_command'}
+    
+    def _add_server(self, server):
+        """Put a server in the registry and the pool, replacing any with the same IP"""
+        previous = self.servers.get(server.ip_address)
+        if previous is not None:
+            self.pool.remove(previous)
+        self.servers[server.ip_address] = server
+        self.pool.append(server)
+        self._schedule_timeout(server)
+    
+    def _schedule_timeout(self, server):
+        """Queue a check for the server having gone quiet since its last heartbeat"""
+        deadline = server.last_heartbeat + self._heartbeat_timeout_ns
+        heapq.heappush(self._deadlines, (deadline, next(self._deadline_seq), server))
     
     def _register_server(self, message, addr):
         """Register a new server in the pool"""
@@ -152,131 +307,159 @@ class CoordinatorService:
         capacity = message.get('capacity', DEFAULT_SERVER_CAPACITY)
         port = message.get('port', 5001)
         
-        with self.server_lock:
-            self.servers[ip] = NetworkServer(capacity, ip, port)
-            print(f"Registered server: {ip} with capacity {capacity}")
+        self._add_server(NetworkServer(capacity, ip, port))
+        print(f"Registered server: {ip} with capacity {capacity}")
     
     def _update_heartbeat(self, message):
         """Update the heartbeat timestamp for a server"""
         ip = message.get('ip')
         allocated_vms = message.get('allocated_vms', [])
         
-        with self.server_lock:
-            if ip in self.servers:
-                self.servers[ip].last_heartbeat = time.time()
-                
-                # vm allocation updated
-                self.servers[ip].allocated = [VM(mem) for mem in allocated_vms]
-                print(f"Updated heartbeat for {ip} with {len(allocated_vms)} VMs: {allocated_vms}")
-            else:
-                # re-register if server not found
-                capacity = message.get('capacity', DEFAULT_SERVER_CAPACITY)
-                port = message.get('port', 5001)
-                self.servers[ip] = NetworkServer(capacity, ip, port)
-                self.servers[ip].allocated = [VM(mem) for mem in allocated_vms]
-                print(f"Re-registered server: {ip} with capacity {capacity}")
-    
-    def _monitor_servers(self):
-        """Monitor server heartbeats and remove inactive servers"""
+        if ip in self.servers:
+            self.servers[ip].last_heartbeat = time.monotonic_ns()
+            self._schedule_timeout(self.servers[ip])
+            
+            # vm allocation updated
+            self.servers[ip].apply_report(allocated_vms)
+            print(f"Updated heartbeat for {ip} with {len(allocated_vms)} VMs: {allocated_vms}")
+        else:
+            # re-register if server not found
+            capacity = message.get('capacity', DEFAULT_SERVER_CAPACITY)
+            port = message.get('port', 5001)
+            self._add_server(NetworkServer(capacity, ip, port))
+            self.servers[ip].apply_report(allocated_vms)
+            print(f"Re-registered server: {ip} with capacity {capacity}")
+    
+    async def _monitor_servers(self):
+        """
+        Monitor server heartbeats and remove inactive servers, sleeping until
+        the earliest point a server could time out rather than polling them all
+        """
         while self.running:
-            with self.server_lock:
-                current_time = time.time()
-                to_remove = []
-                
-                for ip, server in self.servers.items():
-                    if current_time - server.last_heartbeat > self.heartbeat_timeout:
-                        server.is_active = False
-                        to_remove.append(ip)
-                
-                for ip in to_remove:
+            current_time = time.monotonic_ns()
+            while self._deadlines and self._deadlines[0][0] <= current_time:
+                _, _, server = heapq.heappop(self._deadlines)
+                ip = server.ip_address
+                if (self.servers.get(ip) is server
+                        and server.last_heartbeat + self._heartbeat_timeout_ns <= current_time):
+                    server.is_active = False
                     print(f"Server {ip} timed out, removing from pool")
-                    del self.servers[ip]
+                    self.pool.remove(self.servers.pop(ip))
             
-            time.sleep(2)
+            # Deadlines are only ever pushed a full timeout ahead, so with none
+            # queued the next one can't come due sooner than that
+            if self._deadlines:
+                delay = (self._deadlines[0][0] - time.monotonic_ns()) / 1_000_000_000
+            else:
+                delay = self.heartbeat_timeout
+            await asyncio.sleep(max(delay, 0))
     
-    def _allocate_vm(self, message):
+    async def _allocate_vm(self, message):
         """Allocate a VM to one of the servers in the pool"""
         memory = message.get('memory')
         algorithm = message.get('algorithm', 'best_fit')
-        vm = VM(memory)
         
-        with self.server_lock:
-            active_servers = [s for s in self.servers.values() if s.is_active]
-            
-            if not active_servers:
-                print("No active servers available for allocation")
-                return False
-            
-            print(f"Attempting to allocate VM({memory}) using {algorithm}")
-            
-            # find the best server based on the algorithm
-            chosen_server = None
-            
-            if algorithm == 'best_fit':
-                # Find the best fitting server without actually allocating
-                min_remaining = float('inf')
-                for server in active_servers:
-                    if server.can_allocate(vm, LIMIT_RATIO):
-                        remaining = server.free_space() - vm.size()
-                        if remaining < min_remaining:
-                            min_remaining = remaining
-                            chosen_server = server
-            
-            elif algorithm == 'weight_balanced':
-                # Find the best server by score without actually allocating
-                best_score = float('-inf')
-                for server in active_servers:
-                    if server.can_allocate(vm, LIMIT_RATIO):
-                        current_utilization = server.used_memory() / server.capacity
-                        new_utilization = (server.used_memory() + vm.size()) / server.capacity
-                        score = 1 - abs(new_utilization - 0.75)
-                        
-                        if score > best_score:
-                            best_score = score
-                            chosen_server = server
-            
-            else:  # First fit
-                for server in active_servers:
-                    if server.can_allocate(vm, LIMIT_RATIO):
-                        chosen_server = server
-                        break
-            
-            # If we found a suitable server, remotely allocate the VM there
-            if chosen_server:
-                print(f"Selected server {chosen_server.ip_address} for VM({memory})")
-                # Actually allocate on the remote server
-                return chosen_server.remote_allocate_vm(vm)
-            
+        return await self._place_vm(get_vm(memory), algorithm)
+    
+    async def _allocate_vm_batch(self, message, decreasing=False):
+        """
+        Allocate a batch of VMs, one after another.
+        With decreasing, the largest VMs are placed first, which packs the
+        batch onto fewer servers; results still follow the request's order.
+        """
+        algorithm = message.get('algorithm', 'best_fit')
+        vms = [get_vm(memory) for memory in message.get('vms', [])]
+        order = range(len(vms))
+        if decreasing:
+            order = sorted(order, key=lambda i: -vms[i].memory)
+        
+        results = [False] * len(vms)
+        for i in order:
+            results[i] = await self._place_vm(vms[i], algorithm)
+        return results
+    
+    async def _place_vm(self, vm, algorithm):
+        """
+        Pick a server for the VM, then allocate it there without blocking the
+        event loop, so a slow agent doesn't hold up every other allocation,
+        heartbeat and status query for the length of the call
+        """
+        chosen_server = self._choose_server(vm, algorithm)
+        if chosen_server is None:
             return False
+        
+        # Reserve the space in our model before the call, so allocations
+        # chosen while it is in flight see it as taken and go elsewhere
+        chosen_server._unchecked_allocate(vm)
+        generation = chosen_server.generation
+        
+        # Actually allocate on the remote server; the call blocks on a
+        # socket, so it runs on a worker thread to keep the loop free
+        success = await asyncio.to_thread(chosen_server.remote_allocate_vm, vm)
+        
+        if not success:
+            # Give the space back, unless the server has since timed out or
+            # re-registered, or a heartbeat has replaced its VM list; that
+            # list is the agent's own, so it is left as reported
+            if (chosen_server.is_active and self.servers.get(chosen_server.ip_address) is chosen_server
+                    and chosen_server.generation == generation):
+                chosen_server.remove_vm(vm)
+        return success
+    
+    def _choose_server(self, vm, algorithm):
+        """Pick the server to allocate the VM on, or None"""
+        memory = vm.memory
+        pool = self.pool
+        
+        if not pool:
+            print("No active servers available for allocation")
+            return None
+        
+        print(f"Attempting to allocate VM({memory}) using {algorithm}")
+        
+        # Score the whole fleet at once from the pool's capacity/usage
+        # arrays, without actually allocating
+        size = vm.size()
+        
+        if algorithm == 'best_fit':
+            best = best_fit_allocate_vec(pool.capacities, pool.limits, pool.used, size)
+        
+        elif algorithm == 'weight_balanced':
+            best = weight_balanced_allocate_vec(pool.capacities, pool.limits, pool.used, size)
+        
+        else:  # First fit
+            best = first_fit_allocate_vec(pool.limits, pool.used, size)
+        
+        if best >= 0:
+            chosen_server = pool[best]
+            print(f"Selected server {chosen_server.ip_address} for VM({memory})")
+            return chosen_server
+        
+        return None
+    
+    # Status and VM sync replies are written straight to JSON bytes from each
+    # server's pre-encoded fields, rather than built as dicts and encoded.
+    # The repr of an int or float memory size is also its JSON.
     
     def _get_server_status(self):
-        """Get the status of all servers"""
-        with self.server_lock:
-            return {
-                'servers': [
-                    {
-                        'ip': server.ip_address,
-                        'capacity': server.capacity,
-                        'used': server.used_memory(),
-                        'free': server.free_space(),
-                        'active': server.is_active
-                    }
-                    for server in self.servers.values()
-                ]
-            }
+        """Get the status of all servers, as an encoded reply"""
+        entries = [
+            server._status_prefix + b',"used":%a,"free":%a,"active":%s}' % (
+                server.used_memory(), server.free_space(),
+                b'true' if server.is_active else b'false')
+            for server in self.servers.values()
+        ]
+        return b'{"servers":[' + b','.join(entries) + b']}'
     
     def _get_all_vms(self):
-        """Get all VMs allocated across all servers"""
-        with self.server_lock:
-            all_vms = []
-            for server in self.servers.values():
-                if server.is_active:
-                    for vm in server.allocated:
-                        all_vms.append({
-                            'server_ip': server.ip_address,
-                            'memory': vm.memory
-                        })
-            return {'vms': all_vms}
+        """Get all VMs allocated across all servers, as an encoded reply"""
+        entries = []
+        for server in self.servers.values():
+            if server.is_active:
+                prefix = server._vm_prefix + b',"memory":'
+                for vm in server.allocated:
+                    entries.append(prefix + b'%a}' % vm.memory)
+        return b'{"vms":[' + b','.join(entries) + b']}'
 
 
 class ServerAgent:
@@ -292,8 +475,16 @@ class ServerAgent:
         self.capacity = capacity
         
         self.server = Server(capacity)
+        # Allocation requests are handled on a thread each, so the check and
+        # the add of one must not interleave with another's
+        self._server_lock = threading.Lock()
         self.running = False
         
+        # One long-lived connection to the coordinator, shared by
+        # registration, VM sync and heartbeats
+        self._coord_sock = None
+        self._coord_lock = threading.Lock()
+        
         # Get our own IP address
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
@@ -315,6 +506,15 @@ class ServerAgent:
         # sync VMs from coordinator
         self._sync_vms()
         
+        # Everything in a heartbeat but the VM list is fixed, so encode it once
+        # and leave the closing brace off for the list to be appended
+        self._heartbeat_prefix = _dumps({
+            'type': 'heartbeat',
+            'ip': self.ip_address,
+            'capacity': self.capacity,
+            'port': self.server_port
+        })[:-1]
+        
         # start heartbeat thread, to check the connectivity with different pcs
         threading.Thread(target=self._send_heartbeat, daemon=True).start()
         
@@ -326,6 +526,50 @@ class ServerAgent:
     def stop(self):
         """Stop the server agent"""
         self.running = False
+        with self._coord_lock:
+            self._close_coord()
+    
+    def _send_to_coord(self, message):
+        """Send a message over the coordinator connection and return the raw reply"""
+        return self._send_payload_to_coord(_dumps(message))
+    
+    def _send_payload_to_coord(self, payload):
+        """
+        Send an already-encoded message over the coordinator connection and return
+        the raw reply. If the cached connection has gone stale (e.g. the coordinator
+        restarted), it is replaced and the message is sent once more.
+        """
+        with self._coord_lock:
+            reused = self._coord_sock is not None
+            try:
+                return self._coord_round_trip(payload)
+            except OSError:
+                self._close_coord()
+                if not reused:
+                    raise
+            
+            try:
+                return self._coord_round_trip(payload)
+            except OSError:
+                self._close_coord()
+                raise
+    
+    def _coord_round_trip(self, payload):
+        """Send one message and wait for its reply; caller holds _coord_lock"""
+        if self._coord_sock is None:
+            self._coord_sock = connect_socket(self.coordinator_host, self.coordinator_port)
+        
+        send_frame(self._coord_sock, payload)
+        data = recv_frame(self._coord_sock)
+        if not data:
+            raise ConnectionError("Coordinator closed the connection")
+        return data
+    
+    def _close_coord(self):
+        """Drop the coordinator connection so the next message reconnects"""
+        if self._coord_sock is not None:
+            self._coord_sock.close()
+            self._coord_sock = None
     
     def _register(self):
         """Register this server with the coordinator"""
@@ -337,25 +581,17 @@ class ServerAgent:
         }
         
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5.0)  # Set timeout for socket operations
-                s.connect((self.coordinator_host, self.coordinator_port))
-                s.send(json.dumps(message).encode('utf-8'))
+            data = self._send_to_coord(message)
                 
-                data = s.recv(4096).decode('utf-8')
-                if not data:
-                    print("Empty response from coordinator during registration")
-                    return
-                    
-                try:
-                    response = json.loads(data)
-                    
-                    if response.get('status') == 'registered':
-                        print(f"Successfully registered with coordinator")
-                    else:
-                        print(f"Failed to register with coordinator: {response}")
-                except json.JSONDecodeError as e:
-                    print(f"Invalid JSON from coordinator during registration: {data[:100]}... Error: {e}")
+            try:
+                response = _loads(data)
+                
+                if response.get('status') == 'registered':
+                    print(f"Successfully registered with coordinator")
+                else:
+                    print(f"Failed to register with coordinator: {response}")
+            except json.JSONDecodeError as e:
+                print(f"Invalid JSON from coordinator during registration: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
         except Exception as e:
             print(f"Error registering with coordinator: {e}")
     
@@ -364,32 +600,24 @@ class ServerAgent:
         message = {'type': 'sync_vms'}
         
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5.0)
-                s.connect((self.coordinator_host, self.coordinator_port))
-                s.send(json.dumps(message).encode('utf-8'))
+            data = self._send_to_coord(message)
+            
+            try:
+                response = _loads(data)
+                vms = response.get('vms', [])
                 
-                data = s.recv(4096).decode('utf-8')
-                if not data:
-                    print("Empty response from coordinator during VM sync")
-                    return
+                # Reset server's VMs
+                self.server.clear()
                 
-                try:
-                    response = json.loads(data)
-                    vms = response.get('vms', [])
-                    
-                    # Reset server's VMs
-                    self.server.clear()
-                    
-                    # Add VMs that belong to this server
-                    for vm_info in vms:
-                        if vm_info['server_ip'] == self.ip_address:
-                            vm = VM(vm_info['memory'])
-                            self.server.allocate_vm(vm, LIMIT_RATIO)
-                    
-                    print(f"Synced {len(self.server.allocated)} VMs from coordinator")
-                except json.JSONDecodeError as e:
-                    print(f"Invalid JSON from coordinator during VM sync: {data[:100]}... Error: {e}")
+                # Add VMs that belong to this server
+                for vm_info in vms:
+                    if vm_info['server_ip'] == self.ip_address:
+                        vm = get_vm(vm_info['memory'])
+                        self.server.allocate_vm(vm, LIMIT_RATIO)
+                
+                print(f"Synced {len(self.server.allocated)} VMs from coordinator")
+            except json.JSONDecodeError as e:
+                print(f"Invalid JSON from coordinator during VM sync: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
         except Exception as e:
             print(f"Error syncing VMs from coordinator: {e}")
     
@@ -397,26 +625,16 @@ class ServerAgent:
         """Send heartbeat to coordinator periodically"""
         while self.running:
             try:
-                message = {
-                    'type': 'heartbeat',
-                    'ip': self.ip_address,
-                    'capacity': self.capacity,
-                    'port': self.server_port,
-                    'allocated_vms': [vm.memory for vm in self.server.allocated]
-                }
+                allocated_vms = _dumps([vm.memory for vm in self.server.allocated])
+                payload = self._heartbeat_prefix + b',"allocated_vms":' + allocated_vms + b'}'
                 
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(5.0)  # Set timeout for socket operations
-                    s.connect((self.coordinator_host, self.coordinator_port))
-                    s.send(json.dumps(message).encode('utf-8'))
-                    
-                    # More robust response handling
-                    try:
-                        data = s.recv(4096).decode('utf-8')
-                        if data:  # Only try to parse if we got data
-                            response = json.loads(data)
-                    except:
-                        pass  # Silently ignore heartbeat acknowledgment issues
+                data = self._send_payload_to_coord(payload)
+                
+                # More robust response handling
+                try:
+                    response = _loads(data)
+                except:
+                    pass  # Silently ignore heartbeat acknowledgment issues
             except Exception as e:
                 print(f"Error sending heartbeat: {e}")
             
@@ -446,23 +664,25 @@ class ServerAgent:
         """Handle a client connection for VM allocation"""
         try:
             client_socket.settimeout(5.0)  # Set timeout
-            data = client_socket.recv(4096).decode('utf-8')
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            data = recv_frame(client_socket)
             
             if not data:
                 print(f"Empty data received from {addr}")
                 return
                 
             try:
-                message = json.loads(data)
+                message = _loads(data)
             except json.JSONDecodeError as e:
-                print(f"Invalid JSON from {addr}: {data[:100]}... Error: {e}")
-                client_socket.send(json.dumps({'status': 'error', 'message': 'Invalid JSON'}).encode('utf-8'))
+                print(f"Invalid JSON from {addr}: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
+                send_msg(client_socket, {'status': 'error', 'message': 'Invalid JSON'})
                 return
             
             if message['type'] == 'allocate_vm':
                 memory = message['memory']
-                vm = VM(memory)
-                success = self.server.allocate_vm(vm, LIMIT_RATIO)
+                vm = get_vm(memory)
+                with self._server_lock:
+                    success = self.server.allocate_vm(vm, LIMIT_RATIO)
                 
                 response = {'status': 'allocated' if success else 'failed'}
                 print(f"VM allocation request: {memory} - {'Success' if success else 'Failed'}")
@@ -476,11 +696,11 @@ class ServerAgent:
             else:
                 response = {'status': 'unknown_command'}
             
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            send_msg(client_socket, response)
         except Exception as e:
             print(f"Error handling client {addr}: {e}")
             try:
-                client_socket.send(json.dumps({'status': 'error', 'message': str(e)}).encode('utf-8'))
+                send_msg(client_socket, {'status': 'error', 'message': str(e)})
             except:
                 pass
         finally:
@@ -501,47 +721,97 @@ class Client:
         }
         
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5.0)  # Set timeout for socket operations
-                s.connect((self.coordinator_host, self.coordinator_port))
-                s.send(json.dumps(message).encode('utf-8'))
+            with connect_socket(self.coordinator_host, self.coordinator_port) as s:
+                send_msg(s, message)
                 
-                data = s.recv(4096).decode('utf-8')
+                data = recv_frame(s)
                 if not data:
                     print("Empty response from coordinator")
                     return False
                     
                 try:
-                    response = json.loads(data)
+                    response = _loads(data)
                     return response.get('status') == 'allocated'
                 except json.JSONDecodeError as e:
-                    print(f"Invalid JSON from coordinator: {data[:100]}... Error: {e}")
+                    print(f"Invalid JSON from coordinator: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
                     return False
         except Exception as e:
             print(f"Error allocating VM: {e}")
             return False
     
+    def batch_allocate_vm(self, memories, algorithm='best_fit'):
+        """Request allocation of several VMs from the coordinator in one round-trip"""
+        return self._request_batch('allocate_vm_batch', memories, algorithm)
+    
+    def allocate_vms_ffd(self, memories, algorithm='best_fit'):
+        """Like batch_allocate_vm, but the coordinator places the largest VMs first"""
+        return self._request_batch('allocate_vm_batch_ffd', memories, algorithm)
+    
+    def _request_batch(self, message_type, memories, algorithm):
+        """Send a batch allocation request and return a success flag per VM"""
+        message = {
+            'type': message_type,
+            'vms': list(memories),
+            'algorithm': algorithm
+        }
+        
+        try:
+            with connect_socket(self.coordinator_host, self.coordinator_port) as s:
+                send_msg(s, message)
+                
+                data = recv_frame(s)
+                if not data:
+                    print("Empty response from coordinator")
+                    return [False] * len(message['vms'])
+                    
+                try:
+                    response = _loads(data)
+                    results = response.get('results')
+                    if not isinstance(results, list) or len(results) != len(message['vms']):
+                        # e.g. an error reply, which has no results
+                        print(f"Batch allocation failed: {response.get('message', response)}")
+                        return [False] * len(message['vms'])
+                    return [status == 'allocated' for status in results]
+                except json.JSONDecodeError as e:
+                    print(f"Invalid JSON from coordinator: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
+                    return [False] * len(message['vms'])
+        except Exception as e:
+            print(f"Error allocating VMs: {e}")
+            return [False] * len(message['vms'])
+    
     def get_server_status(self):
         """Get status of all servers from the coordinator"""
         message = {'type': 'server_status'}
         
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5.0)  # Set timeout for socket operations
-                s.connect((self.coordinator_host, self.coordinator_port))
-                s.send(json.dumps(message).encode('utf-8'))
+            with connect_socket(self.coordinator_host, self.coordinator_port) as s:
+                send_msg(s, message)
                 
-                data = s.recv(4096).decode('utf-8')
+                data = recv_frame(s)
                 if not data:
                     print("Empty response from coordinator")
                     return {'servers': []}
                     
                 try:
-                    response = json.loads(data)
+                    response = _loads(data)
                     return response
                 except json.JSONDecodeError as e:
-                    print(f"Invalid JSON from coordinator: {data[:100]}... Error: {e}")
+                    print(f"Invalid JSON from coordinator: {data[:100].decode('utf-8', 'replace')}... Error: {e}")
                     return {'servers': []}
         except Exception as e:
             print(f"Error getting server status: {e}")
-            return {'servers': []}
\ No newline at end of file
+            return {'servers': []}
+
+
+def run_until_interrupted(service):
+    """
+    Start a coordinator or server agent and stop it again on Ctrl+C. The
+    service runs on its own threads, so this blocks on an Event rather
+    than spinning until then.
+    """
+    try:
+        service.start()
+        print("Press Ctrl+C to stop")
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
@@ -1,30 +1,32 @@
-from server import Server
-from vm import VM
+from server import Server, ServerPool
+from vm import VM, VM_SIZE
 from allocator import greedy_allocate
 from config import DEFAULT_SERVER_CAPACITY
 
 
-def print_servers(servers):
+def print_servers(servers, verbose=False):
     print("\nCurrent Server States:")
     for i, s in enumerate(servers):
-        print(f"S{i + 1}: {s}")
+        print(f"S{i + 1}: {s.describe(verbose)}")
 
 
 def main():
-    servers = [Server(DEFAULT_SERVER_CAPACITY)]
+    servers = ServerPool([Server(DEFAULT_SERVER_CAPACITY)])
 
-    print("Enter CPU requirements for VMs (type 'exit' to stop):")
+    print("Enter CPU requirements for VMs (type 'exit' to stop, 'status' to list every server's VMs):")
     while True:
         entry = input("New VM > ")
         if entry.lower() == 'exit':
             break
-        try:
-            mem = int(entry)
-            vm = VM(mem)
-            servers = greedy_allocate(servers, vm)
-            print_servers(servers)
-        except ValueError:
+        elif entry.lower() == 'status':
+            print_servers(servers, verbose=True)
+            continue
+        if not VM_SIZE.fullmatch(entry):
             print("Invalid input. Please enter an integer.")
+            continue
+        vm = VM(int(entry))
+        servers = greedy_allocate(servers, vm)
+        print_servers(servers)
 
 
 if __name__ == '__main__':
@@ -1,55 +1,68 @@
-from server import Server
-from vm import VM
+from server import Server, ServerPool
+from vm import VM, get_vm
 from config import LIMIT_RATIO, POOL
+from allocator_kernels import HAVE_NUMBA, first_fit_kernel, fits_nowhere
 import random
-from collections import deque
+from collections import Counter, deque
+import numpy as np
 
 def try_allocate_to_existing(servers, vm):
-    """Try to allocate a VM to any existing server."""
+    """Try to allocate a VM to any existing server; return that server, or None."""
     for server in servers:
         if server.allocate_vm(vm, LIMIT_RATIO):
-            return True
-    return False
+            return server
+    return None
 
-def greedy_allocate(servers: list[Server], new_vm: VM):
+def greedy_allocate(servers: ServerPool, new_vm: VM):
     # allocate to existing servers first if possible
     if try_allocate_to_existing(servers, new_vm):
         return True
     
-    # Try reassignment
-    vm_mappings = []
-    for server in servers:
-        for vm in server.allocated:
-            vm_mappings.append((server, vm))
-    
-    for server, vm in vm_mappings:
-        # Remove the original VM
-        server.remove_vm(vm)
+    # Try reassignment. new_vm fits nowhere as-is, so moving a VM off a
+    # server makes room only on that server, and only if the VM covers its
+    # shortfall. The smallest such VM is the one to try: any server a
+    # bigger one fits on, it fits on too. Candidates are checked against
+    # the pool's arrays rather than by moving VMs and rolling back.
+    size = new_vm.memory
+    if fits_nowhere(servers.limits, size):
+        return False  # no move could make room for it
+    room = servers.limits - servers.used
+    for i, server in enumerate(servers):
+        shortfall = size - room[i]
+        vm = min((vm for vm in server.allocated if vm.memory >= shortfall),
+                 key=VM.size, default=None)
+        if vm is None:
+            continue
         
-        # Try to allocate the new VM
-        new_vm_server = None
-        for s in servers:
-            if s.can_allocate(new_vm):
-                s.allocate_vm(new_vm)
-                new_vm_server = s
-                break
-        
-        if new_vm_server:
-            # Try to allocate the original VM somewhere
-            if try_allocate_to_existing(servers, vm):
-                return True
-            new_vm_server.remove_vm(new_vm)
-        server.allocate_vm(vm)
+        # first other server the displaced VM fits on
+        fits = room >= vm.memory
+        fits[i] = False
+        target = int(np.argmax(fits))
+        if fits[target]:
+            server.remove_vm(vm)
+            server._unchecked_allocate(new_vm)
+            servers[target]._unchecked_allocate(vm)
+            return True
     
     # If we reach here, we couldn't allocate even with reassignment
     return False
 
 # First Fit algorithm with fixed pool
-def first_fit_allocate(servers: list[Server], new_vm: VM):
+def first_fit_allocate(servers: ServerPool, new_vm: VM):
     """
     First Fit allocation - places the VM in the first server that can accommodate it.
     Returns success indicating if allocation was possible.
     """
+    if HAVE_NUMBA:
+        # scan the pool's arrays in compiled code
+        if fits_nowhere(servers.limits, new_vm.memory):
+            return False
+        idx = first_fit_kernel(servers.limits, servers.used, new_vm.memory, 0)
+        if idx < 0:
+            return False
+        servers[idx]._unchecked_allocate(new_vm)
+        return True
+    
     # Try to allocate to the first server with enough space
     for server in servers:
         if server.allocate_vm(new_vm, LIMIT_RATIO):
@@ -59,32 +72,39 @@ def first_fit_allocate(servers: list[Server], new_vm: VM):
     return False
 
 # Best Fit algorithm with fixed pool
-def best_fit_allocate(servers: list[Server], new_vm: VM):
+def best_fit_allocate(servers: ServerPool, new_vm: VM):
     """
     Best Fit allocation - places the VM in the server that leaves the least remaining space.
     Returns success indicating if allocation was possible.
     """
-    best_server = None
-    min_remaining = float('inf')
-    
-    # Find the server with the least remaining space that can fit the VM
-    for server in servers:
-        if server.can_allocate(new_vm, LIMIT_RATIO):
-            remaining = server.free_space() - new_vm.size()
-            if remaining < min_remaining:
-                min_remaining = remaining
-                best_server = server
+    # The pool keeps servers ordered by free space, so the first one that
+    # can take the VM is the best fit
+    best_server = servers.best_fit(new_vm, LIMIT_RATIO)
     
     # If a suitable server was found, allocate the VM there
     if best_server:
-        best_server.allocate_vm(new_vm, LIMIT_RATIO)
+        # best_fit only returns a server the VM fits on
+        best_server._unchecked_allocate(new_vm)
         return True
     
     # If no suitable server found
     return False
 
+# Best Fit Decreasing for a batch of VMs known up front
+def batch_allocate_ffd(servers: ServerPool, vms: list[VM]):
+    """
+    Best Fit Decreasing allocation - places a whole batch largest VM first,
+    each one with Best Fit, which packs the batch onto fewer servers than
+    placing it in arrival order.
+    Returns a success flag per VM, in the order the VMs were given.
+    """
+    results = [False] * len(vms)
+    for i in sorted(range(len(vms)), key=lambda i: -vms[i].memory):
+        results[i] = best_fit_allocate(servers, vms[i])
+    return results
+
 # Next Fit algorithm with fixed pool
-def next_fit_allocate(servers: list[Server], new_vm: VM, last_used_index=None):
+def next_fit_allocate(servers: ServerPool, new_vm: VM, last_used_index=None):
     """
     Next Fit allocation - places the VM in the last used server or the next available one.
     Returns (last_used_index, success) where success indicates if allocation was possible.
@@ -92,6 +112,16 @@ def next_fit_allocate(servers: list[Server], new_vm: VM, last_used_index=None):
     if last_used_index is None or last_used_index >= len(servers):
         last_used_index = 0
     
+    if HAVE_NUMBA:
+        # scan the pool's arrays in compiled code, wrapping around
+        if fits_nowhere(servers.limits, new_vm.memory):
+            return last_used_index, False
+        idx = first_fit_kernel(servers.limits, servers.used, new_vm.memory, last_used_index)
+        if idx < 0:
+            return last_used_index, False
+        servers[idx]._unchecked_allocate(new_vm)
+        return idx, True
+    
     # Start checking from the last used server
     start_idx = last_used_index
     current_idx = start_idx
@@ -109,76 +139,87 @@ def next_fit_allocate(servers: list[Server], new_vm: VM, last_used_index=None):
     return last_used_index, False
 
 # Weight-based algorithm with fixed pool
-def weight_balanced_allocate(servers: list[Server], new_vm: VM):
+def weight_balanced_allocate(servers: ServerPool, new_vm: VM):
     """
     Allocates VMs using a weight-based approach that balances
     between minimizing the number of servers and balancing load.
     Returns success indicating if allocation was possible.
     """
-    best_server = None
-    best_score = float('-inf')
-    
-    # Calculate a score for each server
-    for server in servers:
-        if server.can_allocate(new_vm, LIMIT_RATIO):
-            # Score balances between filling servers efficiently and load balancing
-            # Higher utilization but not too high is preferred
-            current_utilization = server.used_memory() / server.capacity
-            new_utilization = (server.used_memory() + new_vm.size()) / server.capacity
-            
-            # Prefer servers that won't be too empty or too full after allocation
-            # The closer to 75% utilization, the better the score
-            score = 1 - abs(new_utilization - 0.75)
-            
-            if score > best_score:
-                best_score = score
-                best_server = server
-    
-    # If a suitable server was found, allocate the VM there
-    if best_server:
-        best_server.allocate_vm(new_vm, LIMIT_RATIO)
-        return True
+    # Score every server at once from the pool's arrays
+    best = weight_balanced_allocate_vec(servers.capacities, servers.limits,
+                                        servers.used, new_vm.memory)
+    if best < 0:
+        # If no suitable server found
+        return False
     
-    # If no suitable server found
-    return False
-def best_fit_epsilon_greedy_allocate(servers: list[Server], new_vm: VM, epsilon: float = 0.7):
+    # allocate the VM on the best scoring server, already known to fit
+    servers[best]._unchecked_allocate(new_vm)
+    return True
+
+# Vectorized server choice from a pool's capacity/limit/usage arrays.
+# Each returns the chosen index, or -1 if the VM fits on no server
+# (including one too big for the arrays' float64 arithmetic), and
+# allocates nothing; the feasibility test is one array comparison and
+# the choice one masked argmin/argmax, with no per-server branch.
+def first_fit_allocate_vec(limits: np.ndarray, used: np.ndarray, vm_size: int) -> int:
+    """First server the VM fits on"""
+    if fits_nowhere(limits, vm_size):
+        return -1
+    fits = used + vm_size <= limits
+    best = int(np.argmax(fits))
+    return best if fits[best] else -1
+
+def best_fit_allocate_vec(capacities: np.ndarray, limits: np.ndarray,
+                          used: np.ndarray, vm_size: int) -> int:
+    """Server left with the least remaining space among those the VM fits on"""
+    if fits_nowhere(limits, vm_size):
+        return -1
+    fits = used + vm_size <= limits
+    remaining = capacities - used - vm_size
+    best = int(np.argmin(np.where(fits, remaining, np.inf)))
+    return best if fits[best] else -1
+
+def weight_balanced_allocate_vec(capacities: np.ndarray, limits: np.ndarray,
+                                 used: np.ndarray, vm_size: int) -> int:
+    """Server closest to 75% utilization after allocation among those the VM fits on"""
+    if fits_nowhere(limits, vm_size):
+        return -1
+    fits = used + vm_size <= limits
+    # Score balances between filling servers efficiently and load balancing
+    scores = 1 - np.abs((used + vm_size) / capacities - 0.75)
+    best = int(np.argmax(np.where(fits, scores, -np.inf)))
+    return best if fits[best] else -1
+def best_fit_epsilon_greedy_allocate(servers: ServerPool, new_vm: VM, epsilon: float = 0.7):
     """
     Epsilon-Greedy Best Fit allocation:
     - With probability (1-epsilon): Chooses best-fit server (minimizes remaining space)
     - With probability epsilon: Randomly selects any valid server
     Returns True if allocation succeeded, False otherwise
     """
-    # Find all servers that can accommodate the VM
-    valid_servers = [s for s in servers if s.can_allocate(new_vm, LIMIT_RATIO)]
-    
-    if not valid_servers:
-        return False  # No servers can accommodate this VM
-
     # With probability epsilon, explore (choose random valid server)
     if random.random() < epsilon:
-        chosen_server = random.choice(valid_servers)
-        print("Allocating randomly:")
-        return chosen_server.allocate_vm(new_vm, LIMIT_RATIO)
-    
-    # Otherwise exploit (use best-fit strategy)
-    best_server = None
-    min_remaining = float('inf')
-    
-    for server in valid_servers:
-        remaining = server.free_space() - new_vm.size()
-        if remaining < min_remaining:
-            min_remaining = remaining
-            best_server = server
-    
-    if best_server:
-        print("Allocating best fit:")
-        return best_server.allocate_vm(new_vm, LIMIT_RATIO)
+        # Find all servers that can accommodate the VM, from the pool's arrays
+        if fits_nowhere(servers.limits, new_vm.memory):
+            return False  # No servers can accommodate this VM
+        valid = np.flatnonzero(servers.used + new_vm.memory <= servers.limits)
+        if not valid.size:
+            return False  # No servers can accommodate this VM
+        chosen_server = servers[int(valid[random.randrange(valid.size)])]
+        chosen_server._unchecked_allocate(new_vm)
+        return True
     
-    return False  # Should never reach here if valid_servers isn't empty
+    # Otherwise exploit (use best-fit strategy); the pool's free-space
+    # index finds the server with the least remaining space directly,
+    # without listing the valid servers
+    best_server = servers.best_fit(new_vm, LIMIT_RATIO)
+    if best_server is None:
+        return False  # No servers can accommodate this VM
+    best_server._unchecked_allocate(new_vm)
+    return True
 
 from collections import deque
 
-def delayed_bin_packing_allocate(servers: list, new_vm, wait_k=3):
+def delayed_bin_packing_allocate(servers: ServerPool, new_vm, wait_k=3):
     """
     Delayed bin packing with 2-sum matching and forced first-fit flush:
     1. If new_vm.size() == 0: force allocate all waiting VMs using first-fit
@@ -188,51 +229,60 @@ def delayed_bin_packing_allocate(servers: list, new_vm, wait_k=3):
         c. Else add to wait queue and wait until wait_k rounds
     """
 
-    # Initialize static wait queue
+    # Initialize static wait queue, and a count of the waiting VMs of each
+    # size so 2-sum matches are looked up rather than searched for
     if not hasattr(delayed_bin_packing_allocate, "global_waiting_queue"):
         delayed_bin_packing_allocate.global_waiting_queue = deque()
+        delayed_bin_packing_allocate.global_size_counts = Counter()
 
     waiting_queue = delayed_bin_packing_allocate.global_waiting_queue
+    size_counts = delayed_bin_packing_allocate.global_size_counts
 
     # 🔁 Special case: force allocate all waiting VMs using first-fit
-    if new_vm.size() == 0:
-        updated_queue = deque()
-        for vm, wait_count in waiting_queue:
-            allocated = first_fit_allocate(servers, vm)
-            if not allocated:
-                updated_queue.append((vm, wait_count + 1))  # couldn't allocate yet
-        delayed_bin_packing_allocate.global_waiting_queue = updated_queue
+    # (the queue is rotated in place: every entry is popped once and
+    # the ones still waiting go back on the end, in the same order)
+    if new_vm.memory == 0:
+        for _ in range(len(waiting_queue)):
+            vm, wait_count = waiting_queue.popleft()
+            if first_fit_allocate(servers, vm):
+                size_counts[vm.memory] -= 1
+            else:
+                waiting_queue.append((vm, wait_count + 1))  # couldn't allocate yet
         return True
 
-    # Step 1: Try exact match with any server
-    for server in servers:
-        if server.free_space() == new_vm.size():
-            if server.allocate_vm(new_vm, LIMIT_RATIO):
-                return True
+    # Step 1: Try exact match with any server; the best fit is the
+    # exact match if there is one
+    server = servers.best_fit(new_vm, LIMIT_RATIO)
+    if server is not None and server.free_space() == new_vm.memory:
+        server._unchecked_allocate(new_vm)
+        return True
 
     # Step 2: Try 2-sum match with waiting VMs
-    for idx, (waiting_vm, _) in enumerate(waiting_queue):
-        if new_vm.size() + waiting_vm.size() == servers[0].capacity:  # assuming uniform capacity
-            for server in servers:
-                if server.can_allocate(new_vm, LIMIT_RATIO) and server.can_allocate(waiting_vm, LIMIT_RATIO):
-                    server.allocate_vm(new_vm, LIMIT_RATIO)
-                    server.allocate_vm(waiting_vm, LIMIT_RATIO)
-                    del waiting_queue[idx]
-                    return True
+    capacity = servers[0].capacity  # assuming uniform capacity
+    complement = capacity - new_vm.memory
+    if size_counts[complement]:
+        # the pair needs a server with room for both of them together
+        server = servers.best_fit(get_vm(capacity), LIMIT_RATIO)
+        if server is not None:
+            idx = next(i for i, (vm, _) in enumerate(waiting_queue) if vm.memory == complement)
+            waiting_vm, _ = waiting_queue[idx]
+            del waiting_queue[idx]
+            size_counts[complement] -= 1
+            server._unchecked_allocate(new_vm)
+            server._unchecked_allocate(waiting_vm)
+            return True
 
     # Step 3: Add to waiting queue
     waiting_queue.append((new_vm, 0))
+    size_counts[new_vm.memory] += 1
 
     # Step 4: Process existing wait queue for expired wait_k
-    updated_queue = deque()
-    for vm, wait_count in waiting_queue:
+    for _ in range(len(waiting_queue)):
+        vm, wait_count = waiting_queue.popleft()
         wait_count += 1
-        if wait_count >= wait_k:
-            allocated = first_fit_allocate(servers, vm)
-            if not allocated:
-                updated_queue.append((vm, wait_count))  # stay in queue
+        if wait_count >= wait_k and first_fit_allocate(servers, vm):
+            size_counts[vm.memory] -= 1
         else:
-            updated_queue.append((vm, wait_count))
+            waiting_queue.append((vm, wait_count))  # stay in queue
 
-    delayed_bin_packing_allocate.global_waiting_queue = updated_queue
     return True
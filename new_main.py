@@ -1,5 +1,5 @@
-from server import Server
-from vm import VM
+from server import Server, ServerPool
+from vm import VM, VM_BATCH
 from new_allocator import (
     greedy_allocate, 
     first_fit_allocate, 
@@ -7,20 +7,21 @@ from new_allocator import (
     next_fit_allocate,
     weight_balanced_allocate,
     best_fit_epsilon_greedy_allocate,
-    delayed_bin_packing_allocate
+    delayed_bin_packing_allocate,
+    batch_allocate_ffd
 )
 from config import DEFAULT_SERVER_CAPACITY, POOL
 
 
-def print_servers(servers):
+def print_servers(servers, verbose=False):
     print("\nCurrent Server States:")
     for i, s in enumerate(servers):
-        print(f"S{i + 1}: {s}")
+        print(f"S{i + 1}: {s.describe(verbose)}")
 
 
 def main():
     # Create a fixed pool of servers upfront
-    servers = [Server(DEFAULT_SERVER_CAPACITY) for _ in range(POOL)]
+    servers = ServerPool(Server(DEFAULT_SERVER_CAPACITY) for _ in range(POOL))
     last_used_index = 0  # For next-fit algorithm
     
     print("Select allocation algorithm:")
@@ -52,42 +53,61 @@ def main():
         7: "Delayed Bin Packing"
     }
     
+    # Next Fit carries the last used server over from one VM to the next
+    def next_fit(servers, vm):
+        nonlocal last_used_index
+        last_used_index, success = next_fit_allocate(servers, vm, last_used_index)
+        return success
+    
+    allocators = {
+        1: greedy_allocate,
+        2: first_fit_allocate,
+        3: best_fit_allocate,
+        4: next_fit,
+        5: weight_balanced_allocate,
+        6: best_fit_epsilon_greedy_allocate,
+        7: delayed_bin_packing_allocate
+    }
+    # Look the selected algorithm up once, not for every VM
+    allocate = allocators[algorithm]
+    
+    # A batch is placed largest VM first (First/Best Fit Decreasing), which
+    # packs it onto fewer servers than arrival order does. Best Fit has its
+    # own batch allocator; the others are applied to the sorted batch.
+    def allocate_decreasing(servers, vms):
+        results = [False] * len(vms)
+        for i in sorted(range(len(vms)), key=lambda i: -vms[i].memory):
+            results[i] = allocate(servers, vms[i])
+        return results
+    
+    allocate_batch = batch_allocate_ffd if algorithm == 3 else allocate_decreasing
+    
     print(f"\nUsing {algorithm_names[algorithm]} allocation strategy")
-    print("Enter memory requirements for VMs (type 'exit' to stop):")
+    print("Enter memory requirements for VMs, comma-separated to enter a batch "
+          "(type 'exit' to stop, 'status' to see servers):")
     
     while True:
         entry = input("New VM > ")
         if entry.lower() == 'exit':
+            print_servers(servers, verbose=True)
             break
-        try:
-            mem = int(entry)
-            vm = VM(mem)
-            
-            # Apply the selected allocation algorithm
-            success = False
-            
-            if algorithm == 1:
-                success = greedy_allocate(servers, vm)
-            elif algorithm == 2:
-                success = first_fit_allocate(servers, vm)
-            elif algorithm == 3:
-                success = best_fit_allocate(servers, vm)
-            elif algorithm == 4:
-                last_used_index, success = next_fit_allocate(servers, vm, last_used_index)
-            elif algorithm == 5:
-                success = weight_balanced_allocate(servers, vm)
-            elif algorithm == 6:
-                success = best_fit_epsilon_greedy_allocate(servers,vm)
-            elif algorithm == 7:
-                success = delayed_bin_packing_allocate(servers,vm)
+        elif entry.lower() == 'status':
+            # The server states are only printed on request, not after every VM
+            print_servers(servers, verbose=True)
+            continue
+        if not VM_BATCH.fullmatch(entry):
+            print("Invalid input. Please enter an integer, or comma-separated integers.")
+            continue
+        mems = [int(part) for part in entry.split(',')]
+        
+        # A batch is parsed whole up front, then placed all at once with
+        # the selected allocation algorithm
+        results = allocate_batch(servers, [VM(mem) for mem in mems])
+        for mem, success in zip(mems, results):
             if success:
                 print(f"Successfully allocated VM({mem})")
             else:
                 print(f"ERROR: Could not allocate VM({mem}) - insufficient resources in the server pool")
-            
-            print_servers(servers)
-        except ValueError:
-            print("Invalid input. Please enter an integer.")
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 import sys
 import time
 from distributed_allocator import Client
+from vm import VM_SIZE, VM_BATCH
 
 def print_servers(server_status):
     servers = server_status.get('servers', [])
@@ -25,7 +26,8 @@ def main():
     client = Client(coordinator_ip)
     
     print(f"Using {algorithm} allocation strategy")
-    print("Enter memory requirements for VMs (type 'exit' to stop, 'status' to see servers):")
+    print("Enter memory requirements for VMs, comma-separated to send a batch "
+          "(type 'exit' to stop, 'status' to see servers):")
     
     #initial server status
     print("Connecting to coordinator...")
@@ -40,23 +42,40 @@ def main():
             elif entry.lower() == 'status':
                 status = client.get_server_status()
                 print_servers(status)
-            else:
-                try:
-                    mem = int(entry)
-                    print(f"Requesting allocation of VM({mem})...")
-                    success = client.allocate_vm(mem, algorithm)
-                    
+            elif ',' in entry:
+                if not VM_BATCH.fullmatch(entry):
+                    print("Invalid input. Please enter comma-separated integers.")
+                    continue
+                mems = [int(part) for part in entry.split(',')]
+                print(f"Requesting allocation of {len(mems)} VMs...")
+                results = client.batch_allocate_vm(mems, algorithm)
+                
+                for mem, success in zip(mems, results):
                     if success:
                         print(f"Successfully allocated VM({mem})")
                     else:
                         print(f"ERROR: Could not allocate VM({mem}) - insufficient resources in the server pool")
-                    
-                    # Give a short delay for status to update across the network
-                    time.sleep(1)
-                    status = client.get_server_status()
-                    print_servers(status)
-                except ValueError:
+                
+                time.sleep(1)
+                status = client.get_server_status()
+                print_servers(status)
+            else:
+                if not VM_SIZE.fullmatch(entry):
                     print("Invalid input. Please enter an integer.")
+                    continue
+                mem = int(entry)
+                print(f"Requesting allocation of VM({mem})...")
+                success = client.allocate_vm(mem, algorithm)
+                
+                if success:
+                    print(f"Successfully allocated VM({mem})")
+                else:
+                    print(f"ERROR: Could not allocate VM({mem}) - insufficient resources in the server pool")
+                
+                # Give a short delay for status to update across the network
+                time.sleep(1)
+                status = client.get_server_status()
+                print_servers(status)
         except KeyboardInterrupt:
             print("\nExiting...")
             break
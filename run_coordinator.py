@@ -1,5 +1,5 @@
 import sys
-from distributed_allocator import CoordinatorService
+from distributed_allocator import CoordinatorService, run_until_interrupted
 
 def main():
     if len(sys.argv) > 1:
@@ -9,14 +9,8 @@ def main():
     
     coordinator = CoordinatorService(port=port)
     
-    try:
-        coordinator.start()
-        print("Press Ctrl+C to stop")
-        while True:
-            pass
-    except KeyboardInterrupt:
-        coordinator.stop()
-        print("Coordinator stopped")
+    run_until_interrupted(coordinator)
+    print("Coordinator stopped")
 
 if __name__ == '__main__':
     main()
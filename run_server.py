@@ -1,5 +1,5 @@
 import sys
-from distributed_allocator import ServerAgent
+from distributed_allocator import ServerAgent, run_until_interrupted
 from config import DEFAULT_SERVER_CAPACITY
 
 def main():
@@ -19,14 +19,8 @@ def main():
     
     agent = ServerAgent(coordinator_ip, 5000, port, capacity)
     
-    try:
-        agent.start()
-        print("Press Ctrl+C to stop")
-        while True:
-            pass
-    except KeyboardInterrupt:
-        agent.stop()
-        print("Server agent stopped")
+    run_until_interrupted(agent)
+    print("Server agent stopped")
 
 if __name__ == '__main__':
     main()
@@ -1,30 +1,208 @@
-from vm import VM
+from bisect import bisect_left, insort
+from collections import defaultdict
+from itertools import count, islice
+from operator import attrgetter
+import numpy as np
+from vm import VM, get_vm
+from config import LIMIT_RATIO
+
+_memory = attrgetter('memory')  # lets sum() read VM sizes without a Python-level loop
 
 class Server:
+    __slots__ = ('capacity', '_limit', 'allocated', '_used', '_pool', '_slot', '_pool_key')
+
     def __init__(self, capacity: int):
         self.capacity = capacity
+        self._limit = capacity * LIMIT_RATIO  # most memory allowed at the configured ratio
         self.allocated = []
+        self._used = 0  # running total of allocated memory
+        self._pool = None  # ServerPool indexing this server, if any
 
     def __repr__(self):
+        return f"Server(Capacity: {self.capacity}, Used: {self.used_memory()}, Free: {self.free_space()}, VMs: {len(self.allocated)})"
+
+    def describe(self, verbose=True):
+        """Like repr, but listing every allocated VM when verbose"""
+        if not verbose:
+            return repr(self)
         return f"Server(Capacity: {self.capacity}, Used: {self.used_memory()}, Free: {self.free_space()}, VMs: {self.allocated})"
 
     def used_memory(self):
-        return sum(vm.size() for vm in self.allocated)
+        return self._used
 
     def free_space(self):
-        return self.capacity - self.used_memory()
+        return self.capacity - self._used
 
     def can_allocate(self, vm: VM, limit_ratio: float = 1.0):
-        return vm.size() <= self.capacity * limit_ratio - self.used_memory()
+        # at the configured ratio this is an add and compare against the
+        # cached limit, with no multiply
+        if limit_ratio == LIMIT_RATIO:
+            return vm.memory + self._used <= self._limit
+        return vm.memory + self._used <= self.capacity * limit_ratio
 
     def allocate_vm(self, vm: VM, limit_ratio: float = 1.0):
-        if self.can_allocate(vm, limit_ratio):
-            self.allocated.append(vm)
-            return True
-        return False
+        # can_allocate and _unchecked_allocate inlined, as every allocator
+        # loop calls this once per server it tries
+        size = vm.memory
+        limit = self._limit if limit_ratio == LIMIT_RATIO else self.capacity * limit_ratio
+        if size > limit - self._used:
+            return False
+        self.allocated.append(vm)
+        self._used += size
+        if self._pool is not None:
+            self._pool._reindex(self)
+        return True
+
+    def _unchecked_allocate(self, vm: VM):
+        """Allocate a VM the caller has already checked fits"""
+        self.allocated.append(vm)
+        self._used += vm.memory
+        self._reindex()
 
     def remove_vm(self, vm: VM):
         self.allocated.remove(vm)
+        self._used -= vm.memory
+        if self._pool is not None:
+            self._pool._reindex(self)
 
     def clear(self):
-        self.allocated.clear()
\ No newline at end of file
+        self.allocated.clear()
+        self._used = 0
+        self._reindex()
+
+    def replace_vms(self, vms):
+        """Replace the allocated VMs wholesale, e.g. from a remote server's report"""
+        self.allocated = list(vms)
+        self._used = sum(map(_memory, self.allocated))
+        self._reindex()
+
+    def apply_report(self, memories):
+        """
+        Make the allocated VMs match a remote server's list of VM memory sizes,
+        reusing the VM objects already held and looking up only the new ones
+        """
+        if len(memories) == len(self.allocated) and all(
+                vm.memory == mem for vm, mem in zip(self.allocated, memories)):
+            return  # nothing changed, as is usual between heartbeats
+
+        held = defaultdict(list)
+        for vm in self.allocated:
+            held[vm.memory].append(vm)
+        vms = []
+        for mem in memories:
+            same = held.get(mem)
+            vms.append(same.pop() if same else get_vm(mem))
+        self.replace_vms(vms)
+
+    def _reindex(self):
+        if self._pool is not None:
+            self._pool._reindex(self)
+
+
+class ServerPool:
+    """
+    A sequence of servers that also keeps them ordered by free space, plus
+    NumPy arrays of every server's capacity and usage in sequence order.
+    Servers in the pool report every allocation/removal back to it, so
+    best-fit lookups are a binary search and other scoring is vectorized
+    instead of a scan over the pool.
+    Servers are only added with append/extend and taken out with remove,
+    which keep the order, the index and the arrays in step.
+    """
+    def __init__(self, servers=()):
+        self._servers = []
+        self._by_free = []  # sorted (free_space, seq, server) entries
+        self._seq = count()
+        # float64 throughout, as capacities and sizes from the wire may be fractional
+        self._capacities = np.zeros(8)
+        self._limits = np.zeros(8)  # capacity * LIMIT_RATIO, so scoring needn't multiply
+        self._used = np.zeros(8)
+        self.extend(servers)
+
+    def __len__(self):
+        return len(self._servers)
+
+    def __iter__(self):
+        return iter(self._servers)
+
+    def __getitem__(self, index):
+        return self._servers[index]
+
+    def __repr__(self):
+        return f"ServerPool({self._servers})"
+
+    @property
+    def capacities(self):
+        return self._capacities[:len(self)]
+
+    @property
+    def limits(self):
+        return self._limits[:len(self)]
+
+    @property
+    def used(self):
+        return self._used[:len(self)]
+
+    def append(self, server: Server):
+        if server._pool is not None:
+            raise ValueError(f"{server!r} is already in a pool")
+        slot = len(self)
+        if slot == len(self._capacities):
+            # grow the arrays geometrically so appends stay amortized O(1)
+            self._capacities = np.concatenate([self._capacities, np.zeros_like(self._capacities)])
+            self._limits = np.concatenate([self._limits, np.zeros_like(self._limits)])
+            self._used = np.concatenate([self._used, np.zeros_like(self._used)])
+        self._servers.append(server)
+        self._capacities[slot] = server.capacity
+        self._limits[slot] = server._limit
+        self._used[slot] = server._used
+        server._pool = self
+        server._slot = slot
+        server._pool_key = (server.free_space(), next(self._seq))
+        insort(self._by_free, server._pool_key + (server,))
+
+    def extend(self, servers):
+        for server in servers:
+            self.append(server)
+
+    def remove(self, server: Server):
+        """Take a server out of the pool, keeping the others in order"""
+        if server._pool is not self:
+            raise ValueError(f"{server!r} is not in this pool")
+        slot = server._slot
+        del self._by_free[bisect_left(self._by_free, server._pool_key)]
+        del self._servers[slot]
+        end = len(self)
+        self._capacities[slot:end] = self._capacities[slot + 1:end + 1]
+        self._limits[slot:end] = self._limits[slot + 1:end + 1]
+        self._used[slot:end] = self._used[slot + 1:end + 1]
+        for later in islice(self._servers, slot, None):
+            later._slot -= 1
+        server._pool = None
+
+    def _reindex(self, server: Server):
+        self._used[server._slot] = server._used
+        del self._by_free[bisect_left(self._by_free, server._pool_key)]
+        server._pool_key = (server.free_space(), server._pool_key[1])
+        insort(self._by_free, server._pool_key + (server,))
+
+    def fitting(self, vm: VM):
+        """Yield servers with at least vm.size() free, least free space first."""
+        # indexed from the bisection point on, as islice would step through
+        # every entry before it
+        by_free = self._by_free
+        for k in range(bisect_left(by_free, (vm.memory,)), len(by_free)):
+            yield by_free[k][2]
+
+    def best_fit(self, vm: VM, limit_ratio: float = 1.0, exclude=None):
+        """Return the server that would be left with the least free space, or None."""
+        size = vm.memory
+        default_ratio = limit_ratio == LIMIT_RATIO
+        for server in self.fitting(vm):
+            if server is exclude:
+                continue
+            # can_allocate inlined, as this runs for every candidate
+            limit = server._limit if default_ratio else server.capacity * limit_ratio
+            if server._used + size <= limit:
+                return server
+        return None
@@ -0,0 +1,70 @@
+import random
+import unittest
+from unittest import mock
+
+import allocator
+from allocator import greedy_allocate, find_displacement
+from server import Server, ServerPool
+from vm import VM
+from config import LIMIT_RATIO
+from test_new_allocator import random_pool, scan_best_fit, scan_single_move, total, within_limits
+
+
+class FindDisplacementTest(unittest.TestCase):
+    def check(self):
+        for seed in range(1000):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            size = rnd.randint(1, 12)
+            if scan_best_fit(pool, size) is not None:
+                continue  # only searched once the VM fits nowhere as-is
+            move = find_displacement(pool, VM(size))
+            self.assertEqual(move is not None, scan_single_move(pool, size))
+            if move is None:
+                continue
+
+            # the move must be valid, and use the smallest VM that makes room
+            server, vm, target = move
+            self.assertIsNot(server, target)
+            self.assertIn(vm, server.allocated)
+            self.assertTrue(target.can_allocate(vm, LIMIT_RATIO))
+            limit = server.capacity * LIMIT_RATIO
+            self.assertLessEqual(server.used_memory() - vm.memory + size, limit)
+            self.assertEqual(vm.memory, min(v.memory for v in server.allocated
+                                            if server.used_memory() - v.memory + size <= limit))
+
+    def test_scan(self):
+        with mock.patch.object(allocator, 'HAVE_NUMBA', False):
+            self.check()
+
+    def test_kernel(self):
+        # without Numba installed the kernel runs interpreted
+        with mock.patch.object(allocator, 'HAVE_NUMBA', True):
+            self.check()
+
+
+class GreedyAllocateTest(unittest.TestCase):
+    def test_every_vm_is_placed_within_limits(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            servers = ServerPool([Server(10)])
+            placed = []
+            for _ in range(rnd.randint(1, 30)):
+                size = rnd.randint(1, 10)
+                servers = greedy_allocate(servers, VM(size))
+                placed.append(size)
+                self.assertEqual(total(servers), sorted(placed))
+                self.assertTrue(within_limits(servers))
+
+    def test_huge_size_fits_no_existing_server(self):
+        for numba in (False, True):
+            with mock.patch.object(allocator, 'HAVE_NUMBA', numba):
+                servers = ServerPool(Server(10) for _ in range(2))
+                servers[0].allocate_vm(VM(4), LIMIT_RATIO)
+                self.assertIsNone(find_displacement(servers, VM(10**400)))
+                greedy_allocate(servers, VM(10**20))
+                self.assertEqual(total(servers), [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import socket
+import threading
+import unittest
+from unittest import mock
+
+import distributed_allocator
+from distributed_allocator import (
+    CoordinatorService,
+    NetworkServer,
+    Client,
+    MAX_FRAME_SIZE,
+    send_frame,
+    recv_frame,
+    read_frame,
+    _dumps
+)
+from vm import get_vm
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class CoordinatorTestCase(unittest.TestCase):
+    """A coordinator that is never started: messages are handed to it directly"""
+
+    def setUp(self):
+        patcher = mock.patch.object(distributed_allocator, 'print', create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coordinator = CoordinatorService()
+
+    def register(self, ip, capacity):
+        run(self.coordinator._handle_message(
+            {'type': 'register', 'ip': ip, 'capacity': capacity, 'port': 5001}, (ip, 0)))
+        return self.coordinator.servers[ip]
+
+    def remote(self, **kwargs):
+        """Stand in for the agents' side of remote allocation"""
+        return mock.patch.object(NetworkServer, 'remote_allocate_vm', autospec=True, **kwargs)
+
+    def reply_with(self, response):
+        """Patch connect_socket to hand the client a socket the response is already waiting on"""
+        ours, theirs = socket.socketpair()
+        self.addCleanup(theirs.close)
+        send_frame(theirs, response if isinstance(response, bytes) else _dumps(response))
+        return mock.patch.object(distributed_allocator, 'connect_socket', return_value=ours)
+
+
+class FramingTest(unittest.TestCase):
+    def socketpair(self):
+        pair = socket.socketpair()
+        for sock in pair:
+            sock.settimeout(5)
+            self.addCleanup(sock.close)
+        return pair
+
+    def test_frames_arrive_whole(self):
+        sender, receiver = self.socketpair()
+        big = b'x' * 50_000  # more than one recv() returns
+        send_frame(sender, big)
+        self.assertEqual(recv_frame(receiver), big)
+        send_frame(sender, b'{}')
+        self.assertEqual(recv_frame(receiver), b'{}')
+        sender.close()
+        self.assertEqual(recv_frame(receiver), b'')
+
+    def test_close_mid_frame_is_an_error(self):
+        sender, receiver = self.socketpair()
+        sender.sendall(b'\x00\x00\x00\x08abc')
+        sender.close()
+        with self.assertRaises(ConnectionError):
+            recv_frame(receiver)
+
+    def test_oversized_frame_is_refused(self):
+        sender, receiver = self.socketpair()
+        sender.sendall((MAX_FRAME_SIZE + 1).to_bytes(4, 'big'))
+        with self.assertRaises(ConnectionError):
+            recv_frame(receiver)
+
+    def test_stream_reader(self):
+        async def read(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return [await read_frame(reader), await read_frame(reader)]
+
+        self.assertEqual(run(read(b'\x00\x00\x00\x02{}')), [b'{}', b''])
+        with self.assertRaises(ConnectionError):
+            run(read(b'\x00\x00'))
+        with self.assertRaises(ConnectionError):
+            run(read(b'\xff\xff\xff\xff'))
+
+
+class ConnectionTest(CoordinatorTestCase):
+    def test_idle_connection_is_dropped_quietly(self):
+        self.coordinator.heartbeat_timeout = 0.01
+        writer = mock.Mock()
+
+        async def idle():
+            await self.coordinator._handle_connection(asyncio.StreamReader(), writer)
+
+        run(idle())
+        writer.close.assert_called_once_with()
+        distributed_allocator.print.assert_not_called()
+        self.assertEqual(self.coordinator.connections, {})
+
+
+class HeartbeatTimeoutTest(CoordinatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 0
+        clock = mock.patch.object(distributed_allocator.time, 'monotonic_ns', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def at(self, seconds):
+        self.now = int(seconds * 1_000_000_000)
+
+    def monitor(self):
+        """Run one pass of the monitor over the deadlines due now"""
+        async def one_pass():
+            self.coordinator.running = True
+            task = asyncio.ensure_future(self.coordinator._monitor_servers())
+            await asyncio.sleep(0)
+            self.coordinator.running = False
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        run(one_pass())
+
+    def test_only_servers_silent_for_the_timeout_are_removed(self):
+        quiet = self.register('10.0.0.1', 10)
+        chatty = self.register('10.0.0.2', 10)
+        self.at(6)
+        self.coordinator._update_heartbeat({'ip': '10.0.0.2', 'allocated_vms': []})
+
+        self.at(9.9)
+        self.monitor()
+        self.assertEqual(list(self.coordinator.servers), ['10.0.0.1', '10.0.0.2'])
+
+        # chatty's first deadline is also due, but it has heartbeated since
+        self.at(10)
+        self.monitor()
+        self.assertEqual(list(self.coordinator.servers), ['10.0.0.2'])
+        self.assertFalse(quiet.is_active)
+        self.assertEqual(list(self.coordinator.pool), [chatty])
+
+        self.at(16)
+        self.monitor()
+        self.assertEqual(self.coordinator.servers, {})
+        self.assertEqual(len(self.coordinator.pool), 0)
+
+    def test_replaced_server_is_not_timed_out_by_its_predecessor(self):
+        self.register('10.0.0.1', 10)
+        self.at(5)
+        replacement = self.register('10.0.0.1', 10)
+        self.at(10)
+        self.monitor()
+        self.assertIs(self.coordinator.servers['10.0.0.1'], replacement)
+        self.assertTrue(replacement.is_active)
+
+
+class EncodedReplyTest(CoordinatorTestCase):
+    """The hand-built byte replies are the JSON the dict replies used to be"""
+
+    def setUp(self):
+        super().setUp()
+        self.first = self.register('10.0.0.1', 10)
+        self.second = self.register('10.0.0.2', 12.5)
+        self.first.apply_report([3, 4])
+        self.second.apply_report([2.5])
+        self.second.is_active = False
+
+    def reply(self, message_type):
+        response = run(self.coordinator._handle_message({'type': message_type}, None))
+        self.assertIsInstance(response, bytes)
+        return json.loads(response)
+
+    def test_server_status(self):
+        self.assertEqual(self.reply('server_status'), {'servers': [
+            {'ip': '10.0.0.1', 'capacity': 10, 'used': 7, 'free': 3, 'active': True},
+            {'ip': '10.0.0.2', 'capacity': 12.5, 'used': 2.5, 'free': 10.0, 'active': False},
+        ]})
+
+    def test_sync_vms_lists_active_servers_only(self):
+        self.assertEqual(self.reply('sync_vms'), {'vms': [
+            {'server_ip': '10.0.0.1', 'memory': 3},
+            {'server_ip': '10.0.0.1', 'memory': 4},
+        ]})
+
+    def test_empty_registry(self):
+        self.coordinator = CoordinatorService()
+        self.assertEqual(self.reply('server_status'), {'servers': []})
+        self.assertEqual(self.reply('sync_vms'), {'vms': []})
+
+
+class BatchAllocationTest(CoordinatorTestCase):
+    def test_results_follow_request_order(self):
+        self.register('10.0.0.1', 10)
+        with self.remote(return_value=True):
+            response = run(self.coordinator._handle_message(
+                {'type': 'allocate_vm_batch', 'vms': [6, 3, 6, 2], 'algorithm': 'first_fit'}, None))
+        self.assertEqual(response, {'results': ['allocated', 'allocated', 'failed', 'failed']})
+        self.assertEqual([vm.memory for vm in self.coordinator.servers['10.0.0.1'].allocated], [6, 3])
+
+    def test_client_reads_results(self):
+        with self.reply_with({'results': ['allocated', 'failed']}):
+            self.assertEqual(Client('host').batch_allocate_vm([1, 2]), [True, False])
+
+    def test_client_fails_every_vm_on_error_reply(self):
+        with self.reply_with({'status': 'error', 'message': 'boom'}):
+            self.assertEqual(Client('host').batch_allocate_vm([1, 2, 3]), [False] * 3)
+        distributed_allocator.print.assert_called_with("Batch allocation failed: boom")
+        with self.reply_with({'results': ['allocated']}):
+            self.assertEqual(Client('host').batch_allocate_vm([1, 2]), [False] * 2)
+
+
+class PlacementTest(CoordinatorTestCase):
+    def allocate(self, memory, algorithm):
+        return run(self.coordinator._handle_message(
+            {'type': 'allocate_vm', 'memory': memory, 'algorithm': algorithm}, None))
+
+    def test_fractional_sizes_are_scored_exactly(self):
+        server = self.register('10.0.0.1', 10.5)
+        with self.remote(return_value=True):
+            for algorithm in ('best_fit', 'weight_balanced', 'first_fit'):
+                self.assertEqual(self.allocate(2.5, algorithm), {'status': 'allocated'})
+            self.assertEqual(self.allocate(3.5, 'best_fit'), {'status': 'failed'})
+        self.assertEqual(server.used_memory(), 7.5)
+        self.assertEqual(self.coordinator.pool.capacities.tolist(), [10.5])
+        self.assertEqual(self.coordinator.pool.used.tolist(), [7.5])
+
+    def test_huge_sizes_fail(self):
+        self.register('10.0.0.1', 10)
+        with self.remote(return_value=True) as remote:
+            for algorithm in ('best_fit', 'weight_balanced', 'first_fit'):
+                for memory in (10**20, 2**63 - 1):
+                    self.assertEqual(self.allocate(memory, algorithm), {'status': 'failed'})
+        remote.assert_not_called()
+
+
+class ReservationTest(CoordinatorTestCase):
+    """Space is reserved in the model while the agent is being called"""
+
+    def blocking_remote(self, success):
+        """A remote allocation that waits for the test to let it finish"""
+        self.called = threading.Event()
+        self.proceed = threading.Event()
+        def remote_allocate_vm(server, vm):
+            self.called.set()
+            self.proceed.wait(5)
+            return success
+        return self.remote(side_effect=remote_allocate_vm)
+
+    async def in_flight(self, coro):
+        """Start a placement and wait until its remote call is under way"""
+        task = asyncio.ensure_future(coro)
+        while not self.called.is_set():
+            await asyncio.sleep(0.001)
+        return task
+
+    def test_concurrent_placements_use_different_servers(self):
+        first = self.register('10.0.0.1', 10)
+        second = self.register('10.0.0.2', 10)
+
+        async def place_two():
+            vm = get_vm(6)
+            return await asyncio.gather(self.coordinator._place_vm(vm, 'best_fit'),
+                                        self.coordinator._place_vm(vm, 'best_fit'))
+
+        with self.remote(return_value=True):
+            self.assertEqual(run(place_two()), [True, True])
+        self.assertEqual([first.used_memory(), second.used_memory()], [6, 6])
+
+    def test_reservation_is_held_during_the_call(self):
+        server = self.register('10.0.0.1', 10)
+
+        async def check():
+            task = await self.in_flight(self.coordinator._place_vm(get_vm(6), 'best_fit'))
+            self.assertEqual(server.used_memory(), 6)
+            self.assertFalse(await self.coordinator._place_vm(get_vm(6), 'best_fit'))
+            self.proceed.set()
+            return await task
+
+        with self.blocking_remote(True):
+            self.assertTrue(run(check()))
+        self.assertEqual(server.used_memory(), 6)
+
+    def test_failed_call_gives_space_back(self):
+        server = self.register('10.0.0.1', 10)
+        with self.remote(return_value=False):
+            self.assertFalse(run(self.coordinator._place_vm(get_vm(6), 'best_fit')))
+        self.assertEqual(server.used_memory(), 0)
+        self.assertEqual(self.coordinator.pool.used.tolist(), [0])
+
+    def test_failed_call_keeps_a_report_received_meanwhile(self):
+        server = self.register('10.0.0.1', 10)
+        server.apply_report([3])
+
+        async def race():
+            task = await self.in_flight(self.coordinator._place_vm(get_vm(3), 'best_fit'))
+            # the agent still reports only its own VM of the same size
+            self.coordinator._update_heartbeat({'ip': '10.0.0.1', 'allocated_vms': [3]})
+            self.proceed.set()
+            return await task
+
+        with self.blocking_remote(False):
+            self.assertFalse(run(race()))
+        self.assertEqual([vm.memory for vm in server.allocated], [3])
+        self.assertEqual(self.coordinator.pool.used.tolist(), [3])
+
+    def test_failed_call_to_replaced_server_changes_nothing(self):
+        server = self.register('10.0.0.1', 10)
+
+        async def race():
+            task = await self.in_flight(self.coordinator._place_vm(get_vm(6), 'best_fit'))
+            self.coordinator._register_server({'ip': '10.0.0.1', 'capacity': 10}, ('10.0.0.1', 0))
+            self.proceed.set()
+            return await task
+
+        with self.blocking_remote(False):
+            self.assertFalse(run(race()))
+        self.assertIsNot(self.coordinator.servers['10.0.0.1'], server)
+        self.assertEqual(self.coordinator.pool.used.tolist(), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+import random
+import unittest
+from collections import Counter
+from unittest import mock
+
+import new_allocator
+from new_allocator import (
+    greedy_allocate,
+    first_fit_allocate,
+    best_fit_allocate,
+    next_fit_allocate,
+    weight_balanced_allocate,
+    batch_allocate_ffd,
+    best_fit_epsilon_greedy_allocate,
+    delayed_bin_packing_allocate,
+    first_fit_allocate_vec,
+    best_fit_allocate_vec,
+    weight_balanced_allocate_vec
+)
+from server import Server, ServerPool
+from vm import VM
+from config import LIMIT_RATIO
+
+# Plain scans over a list of servers, as the allocators worked before the
+# pool's index and arrays; each returns the chosen server's index or None
+
+def scan_first_fit(servers, size, start=0):
+    n = len(servers)
+    for k in range(n):
+        i = (start + k) % n
+        if servers[i].can_allocate(VM(size), LIMIT_RATIO):
+            return i
+    return None
+
+def scan_best_fit(servers, size):
+    best = None
+    for i, server in enumerate(servers):
+        if server.can_allocate(VM(size), LIMIT_RATIO) and (
+                best is None or server.free_space() < servers[best].free_space()):
+            best = i
+    return best
+
+def scan_weight_balanced(servers, size):
+    best, best_score = None, float('-inf')
+    for i, server in enumerate(servers):
+        if server.can_allocate(VM(size), LIMIT_RATIO):
+            score = 1 - abs((server.used_memory() + size) / server.capacity - 0.75)
+            if score > best_score:
+                best, best_score = i, score
+    return best
+
+def scan_single_move(servers, size):
+    """Whether moving one VM to another server makes room for a VM of this size"""
+    for i, server in enumerate(servers):
+        for vm in server.allocated:
+            if server.used_memory() - vm.memory + size > server.capacity * LIMIT_RATIO:
+                continue
+            if any(t != i and other.can_allocate(vm, LIMIT_RATIO) for t, other in enumerate(servers)):
+                return True
+    return False
+
+
+def random_pool(rnd):
+    pool = ServerPool(Server(rnd.choice([8, 10, 12])) for _ in range(rnd.randint(1, 6)))
+    for server in pool:
+        for _ in range(rnd.randint(0, 4)):
+            server.allocate_vm(VM(rnd.randint(1, 5)), LIMIT_RATIO)
+    return pool
+
+def layout(servers):
+    return [[vm.memory for vm in server.allocated] for server in servers]
+
+def total(servers):
+    return sorted(vm.memory for server in servers for vm in server.allocated)
+
+def within_limits(servers):
+    return all(server.used_memory() <= server.capacity * LIMIT_RATIO for server in servers)
+
+
+class ScanEquivalenceTest(unittest.TestCase):
+    """Each allocator places every VM where the plain scan would have"""
+
+    def check(self, allocate, scan):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            for _ in range(rnd.randint(1, 15)):
+                size = rnd.randint(1, 9)
+                expected = scan(pool, size)
+                before = layout(pool)
+                if expected is not None:
+                    before[expected].append(size)
+                self.assertEqual(allocate(pool, VM(size)), expected is not None)
+                self.assertEqual(layout(pool), before)
+
+    def test_first_fit(self):
+        self.check(first_fit_allocate, scan_first_fit)
+
+    def test_best_fit(self):
+        self.check(best_fit_allocate, scan_best_fit)
+
+    def test_next_fit(self):
+        last_used = 0
+        def allocate(servers, vm):
+            nonlocal last_used
+            last_used, success = next_fit_allocate(servers, vm, last_used)
+            return success
+        def scan(servers, size):
+            return scan_first_fit(servers, size, last_used if last_used < len(servers) else 0)
+        self.check(allocate, scan)
+
+    def test_compiled_paths(self):
+        # without Numba installed the kernels run interpreted, which still
+        # checks the array-based paths against the scans
+        with mock.patch.object(new_allocator, 'HAVE_NUMBA', True):
+            self.test_first_fit()
+            self.test_next_fit()
+
+    def test_weight_balanced(self):
+        self.check(weight_balanced_allocate, scan_weight_balanced)
+
+    def test_vectorized_choice(self):
+        kernels = [
+            (lambda pool, size: first_fit_allocate_vec(pool.limits, pool.used, size), scan_first_fit),
+            (lambda pool, size: best_fit_allocate_vec(pool.capacities, pool.limits, pool.used, size), scan_best_fit),
+            (lambda pool, size: weight_balanced_allocate_vec(pool.capacities, pool.limits, pool.used, size),
+             scan_weight_balanced),
+        ]
+        for seed in range(300):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            size = rnd.randint(1, 9)
+            for kernel, scan in kernels:
+                expected = scan(pool, size)
+                self.assertEqual(kernel(pool, size), -1 if expected is None else expected)
+
+
+class BatchTest(unittest.TestCase):
+    def test_places_largest_first_and_reports_in_request_order(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            sizes = [rnd.randint(1, 9) for _ in range(rnd.randint(1, 8))]
+
+            # the same placements as best fit over the sizes largest first
+            expected_pool = ServerPool(Server(s.capacity) for s in pool)
+            for server, copy in zip(pool, expected_pool):
+                for vm in server.allocated:
+                    copy.allocate_vm(vm, LIMIT_RATIO)
+            placed = {}
+            for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+                placed[i] = best_fit_allocate(expected_pool, VM(sizes[i]))
+
+            results = batch_allocate_ffd(pool, [VM(size) for size in sizes])
+            self.assertEqual(results, [placed[i] for i in range(len(sizes))])
+            self.assertEqual(layout(pool), layout(expected_pool))
+
+
+class GreedyTest(unittest.TestCase):
+    def test_succeeds_exactly_when_a_single_move_makes_room(self):
+        for seed in range(1000):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            size = rnd.randint(1, 12)
+            fits = scan_first_fit(pool, size) is not None
+            movable = scan_single_move(pool, size)
+            before = total(pool)
+            success = greedy_allocate(pool, VM(size))
+            self.assertEqual(success, fits or movable)
+            self.assertEqual(total(pool), sorted(before + [size]) if success else before)
+            self.assertTrue(within_limits(pool))
+
+
+class EpsilonGreedyTest(unittest.TestCase):
+    def test_places_vm_on_a_server_it_fits(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            size = rnd.randint(1, 9)
+            fits = scan_first_fit(pool, size) is not None
+            before = total(pool)
+            random.seed(seed)
+            self.assertEqual(best_fit_epsilon_greedy_allocate(pool, VM(size)), fits)
+            self.assertEqual(total(pool), sorted(before + [size]) if fits else before)
+            self.assertTrue(within_limits(pool))
+
+    def test_exploits_best_fit(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            size = rnd.randint(1, 9)
+            expected = scan_best_fit(pool, size)
+            before = layout(pool)
+            if expected is not None:
+                before[expected].append(size)
+            self.assertEqual(best_fit_epsilon_greedy_allocate(pool, VM(size), epsilon=0), expected is not None)
+            self.assertEqual(layout(pool), before)
+
+
+class DelayedBinPackingTest(unittest.TestCase):
+    def setUp(self):
+        # the allocator keeps its wait queue between calls
+        for name in ('global_waiting_queue', 'global_size_counts'):
+            if hasattr(delayed_bin_packing_allocate, name):
+                delattr(delayed_bin_packing_allocate, name)
+    tearDown = setUp
+
+    def waiting(self):
+        return [vm.memory for vm, _ in delayed_bin_packing_allocate.global_waiting_queue]
+
+    def test_no_vm_is_lost(self):
+        for seed in range(500):
+            self.setUp()
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            submitted = total(pool)
+            for _ in range(rnd.randint(1, 20)):
+                size = rnd.choice([0] + list(range(1, 10)))
+                if size:
+                    submitted.append(size)
+                delayed_bin_packing_allocate(pool, VM(size))
+                self.assertEqual(sorted(total(pool) + self.waiting()), sorted(submitted))
+                self.assertTrue(within_limits(pool))
+                counts = delayed_bin_packing_allocate.global_size_counts
+                self.assertEqual(+counts, Counter(self.waiting()))
+
+    def test_exact_match_takes_first_server_with_that_much_free(self):
+        for seed in range(300):
+            self.setUp()
+            rnd = random.Random(seed)
+            pool = random_pool(rnd)
+            size = rnd.randint(1, 9)
+            exact = next((i for i, s in enumerate(pool) if s.free_space() == size), None)
+            if exact is None:
+                continue
+            before = layout(pool)
+            before[exact].append(size)
+            delayed_bin_packing_allocate(pool, VM(size))
+            self.assertEqual(layout(pool), before)
+
+
+class OversizedVMTest(unittest.TestCase):
+    def test_huge_sizes_do_not_fit(self):
+        allocators = [greedy_allocate, first_fit_allocate, best_fit_allocate, weight_balanced_allocate,
+                      best_fit_epsilon_greedy_allocate,
+                      lambda servers, vm: next_fit_allocate(servers, vm)[1]]
+        for size in (10**20, 2**63 - 1, 10**400):
+            for allocate in allocators:
+                for numba in (False, True):
+                    with mock.patch.object(new_allocator, 'HAVE_NUMBA', numba):
+                        pool = ServerPool(Server(10) for _ in range(3))
+                        self.assertFalse(allocate(pool, VM(size)))
+                        self.assertEqual(total(pool), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import random
+import unittest
+from collections import Counter
+
+from server import Server, ServerPool
+from vm import VM
+
+
+def check_pool(test, pool, expected):
+    """Assert the pool holds exactly the expected servers, with its index and arrays in step"""
+    test.assertEqual(list(pool), expected)
+    test.assertEqual(len(pool), len(expected))
+    for slot, server in enumerate(expected):
+        test.assertIs(server._pool, pool)
+        test.assertEqual(server._slot, slot)
+        test.assertEqual(server.used_memory(), sum(vm.memory for vm in server.allocated))
+    test.assertEqual(pool.capacities.tolist(), [s.capacity for s in expected])
+    test.assertEqual(pool.limits.tolist(), [s._limit for s in expected])
+    test.assertEqual(pool.used.tolist(), [s.used_memory() for s in expected])
+    test.assertEqual(pool._by_free, sorted(pool._by_free, key=lambda entry: entry[:2]))
+    test.assertEqual(sorted(id(entry[2]) for entry in pool._by_free),
+                     sorted(id(s) for s in expected))
+    for free, _, server in pool._by_free:
+        test.assertEqual(free, server.free_space())
+
+
+class ServerPoolTest(unittest.TestCase):
+    def test_random_operations_keep_index_in_step(self):
+        for seed in range(200):
+            rnd = random.Random(seed)
+            pool = ServerPool()
+            expected = []
+            for _ in range(60):
+                op = rnd.random()
+                if op < 0.2 or not expected:
+                    server = Server(rnd.choice([8, 10, 12]))
+                    pool.append(server)
+                    expected.append(server)
+                elif op < 0.3:
+                    server = expected.pop(rnd.randrange(len(expected)))
+                    pool.remove(server)
+                    self.assertIsNone(server._pool)
+                elif op < 0.7:
+                    rnd.choice(expected).allocate_vm(VM(rnd.randint(1, 6)), 1)
+                elif op < 0.85:
+                    server = rnd.choice(expected)
+                    if server.allocated:
+                        server.remove_vm(rnd.choice(server.allocated))
+                elif op < 0.95:
+                    rnd.choice(expected).apply_report([rnd.randint(1, 3) for _ in range(rnd.randint(0, 3))])
+                else:
+                    rnd.choice(expected).clear()
+                check_pool(self, pool, expected)
+
+    def test_best_fit_matches_scan(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            pool = ServerPool(Server(rnd.choice([8, 10, 12])) for _ in range(rnd.randint(1, 6)))
+            for server in pool:
+                for _ in range(rnd.randint(0, 4)):
+                    server.allocate_vm(VM(rnd.randint(1, 4)), 1)
+            vm = VM(rnd.randint(1, 12))
+
+            # least free space left among servers the VM fits on, earliest on ties
+            fitting = [s for s in pool if s.can_allocate(vm, 1)]
+            scan = min(fitting, key=lambda s: s.free_space() - vm.memory, default=None)
+            self.assertIs(pool.best_fit(vm, 1), scan)
+
+    def test_remove_rejects_server_not_in_pool(self):
+        pool = ServerPool([Server(10)])
+        other = ServerPool([Server(10)])
+        with self.assertRaises(ValueError):
+            pool.remove(Server(10))
+        with self.assertRaises(ValueError):
+            pool.remove(other[0])
+        check_pool(self, other, [other[0]])
+
+    def test_append_rejects_server_already_in_a_pool(self):
+        server = Server(10)
+        pool = ServerPool([server])
+        with self.assertRaises(ValueError):
+            pool.append(server)
+        with self.assertRaises(ValueError):
+            ServerPool([server])
+        check_pool(self, pool, [server])
+
+    def test_only_supported_mutators_exist(self):
+        pool = ServerPool([Server(10)])
+        for name in ('insert', 'pop', 'clear', 'sort', '__setitem__', '__delitem__', '__iadd__'):
+            self.assertFalse(hasattr(pool, name), name)
+
+
+class ApplyReportTest(unittest.TestCase):
+    def test_matches_report_and_reuses_held_vms(self):
+        for seed in range(300):
+            rnd = random.Random(seed)
+            server = Server(100)
+            pool = ServerPool([server])
+            server.replace_vms(VM(rnd.randint(1, 5)) for _ in range(rnd.randint(0, 6)))
+            held = {id(vm) for vm in server.allocated}
+            held_sizes = Counter(vm.memory for vm in server.allocated)
+            report = [rnd.randint(1, 5) for _ in range(rnd.randint(0, 6))]
+
+            server.apply_report(report)
+            self.assertEqual([vm.memory for vm in server.allocated], report)
+            check_pool(self, pool, [server])
+            # each reported size is served from the VMs already held first
+            reused = sum(id(vm) in held for vm in server.allocated)
+            self.assertEqual(reused, sum((Counter(report) & held_sizes).values()))
+
+    def test_unchanged_report_keeps_the_list(self):
+        server = Server(10)
+        server.apply_report([3, 4])
+        allocated = server.allocated
+        server.apply_report([3, 4])
+        self.assertIs(server.allocated, allocated)
+
+
+if __name__ == '__main__':
+    unittest.main()
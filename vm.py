@@ -1,4 +1,8 @@
+import re
+
 class VM:
+    __slots__ = ('memory',)
+
     def __init__(self, memory: int):
         self.memory = memory
 
@@ -6,4 +10,26 @@ class VM:
         return f"VM({self.memory})"
 
     def size(self):
-        return self.memory
\ No newline at end of file
+        return self.memory
+
+
+# A VM is just its memory size, so VMs built from wire messages are shared
+# per size rather than constructed anew for every message
+_VM_CACHE: dict[int, VM] = {}
+_VM_CACHE_LIMIT = 10000
+
+def get_vm(memory: int) -> VM:
+    """Return the shared VM of the given memory size"""
+    vm = _VM_CACHE.get(memory)
+    if vm is None:
+        if len(_VM_CACHE) >= _VM_CACHE_LIMIT:
+            _VM_CACHE.clear()  # keep arbitrary client-supplied sizes from piling up
+        vm = _VM_CACHE[memory] = VM(memory)
+    return vm
+
+
+# VM memory sizes as typed at the CLI prompts: one size, or a
+# comma-separated batch of them. Checking an entry against these up front
+# avoids raising ValueError for every bad entry.
+VM_SIZE = re.compile(r'\s*\d+\s*')
+VM_BATCH = re.compile(r'\s*\d+\s*(?:,\s*\d+\s*)*')
\ No newline at end of file